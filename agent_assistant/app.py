@@ -1,15 +1,28 @@
 import streamlit as st
 import boto3
 import json
+import os
 import uuid
-from agentselector import BedrockAgentSelector
+from agentselector import BedrockAgentSelector, EmbeddingError, regions_from_env
 
 # Set up the page configuration
 st.set_page_config(page_title="Amazon Bedrock Agent Assistant", page_icon="🤖")
 
+# Regions to route across: BEDROCK_AGENT_REGIONS (comma-separated), else AWS_REGION
+REGIONS = regions_from_env()
+
+# Seconds between background catalog refreshes of the shared selector
+AGENT_REFRESH_INTERVAL = float(os.environ.get("AGENT_REFRESH_INTERVAL", "300"))
+
+# Cold-start from the registry snapshot in AGENT_REGISTRY_SNAPSHOT; AGENT_OFFLINE=1 serves it alone
+OFFLINE = os.environ.get("AGENT_OFFLINE", "0") == "1"
+
 # Initialize session state variables if they don't exist
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'conversation_id' not in st.session_state:
+    # Follow-up questions in this browser session stay with the same agent session
+    st.session_state.conversation_id = str(uuid.uuid4())
 
 def initialize_bedrock_client(region):
     """Initialize and return the Amazon Bedrock client"""
@@ -28,19 +41,41 @@ def list_available_agents(client, region):
         # Note: This is a simplified approach. In a real application, 
         # you might use the bedrock-agent service to list agents
         bedrock_agent = boto3.client('bedrock-agent', region_name = region)
-        response = bedrock_agent.list_agents()
-        return response.get('agentSummaries', [])
+        agents = []
+        for page in bedrock_agent.get_paginator('list_agents').paginate():
+            agents.extend(page.get('agentSummaries', []))
+        return agents
     except Exception as e:
         st.error(f"Error listing agents: {str(e)}")
         return []
 
+@st.cache_resource
+def get_agent_selector():
+    """Create one selector per server process and keep its catalog and embeddings warm"""
+    agent_selector = BedrockAgentSelector(regions=REGIONS, offline=OFFLINE)
+    agent_selector.warm_up()
+    if AGENT_REFRESH_INTERVAL > 0:
+        agent_selector.start_background_refresh(AGENT_REFRESH_INTERVAL)
+    return agent_selector
+
+def sync_catalog(agent_selector, agents):
+    """Refresh the selector when the live agent list has agents it has not seen at their latest update"""
+    catalog = agent_selector.agents_by_id
+    listed = {agent['agentId']: agent.get('updatedAt') for agent in agents}
+    if set(catalog) - set(listed) or any(
+        agent_id not in catalog or catalog[agent_id].get('summary_updated_at') != updated_at
+        for agent_id, updated_at in listed.items()
+    ):
+        # Only added, changed and deleted agents are described and embedded again
+        agent_selector.refresh()
+
 
 # Main app UI
 st.title("🤖 Amazon Bedrock Agent Assistant")
 st.markdown("Ask a question and I'll find the right agent to help you!")
 
 # Initialize the Bedrock client
-bedrock_client = initialize_bedrock_client("us-west-2")
+bedrock_client = initialize_bedrock_client(REGIONS[0])
 
 # User input
 user_query = st.text_input("Your question:", key="user_input")
@@ -51,15 +86,24 @@ if user_query:
         # Add user query to chat history
         st.session_state.chat_history.append({"role": "user", "content": user_query})
         
-        # List available agents
-        agents = list_available_agents(bedrock_client, "us-west-2")
+        # List available agents; offline, the snapshot catalog is all there is
+        if OFFLINE:
+            agents = get_agent_selector().get_all_agents()
+        else:
+            agents = [agent for region in REGIONS for agent in list_available_agents(bedrock_client, region)]
         
         if not agents:
             response_text = "No agents available in the registry. Please check your AWS configuration."
         else:
             st.info(f"Finding the suitable agent from availble agents: {len(agents)}")
-            agent_selector = BedrockAgentSelector()
-            best_agent = agent_selector.select_agent(user_query)
+            agent_selector = get_agent_selector()
+            if not OFFLINE:
+                sync_catalog(agent_selector, agents)
+            try:
+                best_agent, session = agent_selector.route_conversation(st.session_state.conversation_id, user_query)
+            except EmbeddingError as e:
+                st.error(str(e))
+                best_agent, session = None, None
             
             if not best_agent:
                 response_text = "Couldn't find a suitable agent for your query."
@@ -69,12 +113,17 @@ if user_query:
                 agent_name = best_agent.get('name')
                 
                 print(best_agent)
-                st.info(f"Using agent: {agent_name}")
+                st.info(f"Using agent: {agent_name} ({best_agent.get('region')})")
 
-                response_text = agent_selector.invoke_agent(best_agent, user_query)
+                # Render the answer as it streams in; the chat history below shows it once complete
+                live_response = st.empty()
+                with live_response.container():
+                    st.markdown("**Assistant:**")
+                    response_text = st.write_stream(agent_selector.invoke_agent_stream(best_agent, user_query, session=session))
+                live_response.empty()
         
         # Add response to chat history
-        st.session_state.chat_history.append({"role": "assistant", "content": response_text['response']})
+        st.session_state.chat_history.append({"role": "assistant", "content": response_text})
 
 # Display chat history
 st.markdown("### Conversation")
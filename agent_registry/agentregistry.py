@@ -3,13 +3,22 @@ import boto3
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import gzip
+import hashlib
 import json
+import re
 import time
 from datetime import datetime, timedelta
 import os
 from botocore.exceptions import ClientError
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import registry_snapshot
+
+# Settings below are read from .env as well as the environment
+load_dotenv()
 
 # Set page configuration
 st.set_page_config(
@@ -287,32 +296,540 @@ def initialize_clients(access_key, secret_key, region):
         st.error(f"Failed to initialize AWS clients: {str(e)}")
         return None, None, None, None
 
+# Seconds each kind of AWS data is cached across Streamlit reruns
+CACHE_TTLS = {
+    'agents': 300,
+    'agent_details': 300,
+    'action_groups': 600,
+    'knowledge_bases': 600,
+    'knowledge_base_details': 900,
+    'action_group_details': 900,
+    'data_sources': 900,
+    'aliases': 300,
+    'subagents': 600,
+    'metrics': 300,
+}
+
+# Cached fetchers: they raise instead of reporting errors, so failures are never cached.
+# Client arguments start with an underscore so Streamlit does not hash them. The cache is
+# shared by every session, and sessions may use different credentials, so the account
+# (see _account_of) and the region are passed explicitly to keep each one's data apart.
+
+@st.cache_data(ttl=CACHE_TTLS['agents'], show_spinner=False)
+def _fetch_all_agents(_bedrock_agent, account, region):
+    agents = []
+    paginator = _bedrock_agent.get_paginator('list_agents')
+    for page in paginator.paginate():
+        agents.extend(page.get('agentSummaries', []))
+    return agents, time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['agent_details'], show_spinner=False)
+def _fetch_agent_details(_bedrock_agent, account, region, agent_id):
+    response = _bedrock_agent.get_agent(agentId=agent_id)
+    return response.get('agent'), time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['action_groups'], show_spinner=False)
+def _fetch_agent_action_groups(_bedrock_agent, account, region, agent_id):
+    action_groups = []
+    paginator = _bedrock_agent.get_paginator('list_agent_action_groups')
+    for page in paginator.paginate(agentId=agent_id, agentVersion='DRAFT'):
+        action_groups.extend(page.get('actionGroupSummaries', []))
+    return action_groups, time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['knowledge_bases'], show_spinner=False)
+def _fetch_agent_knowledge_bases(_bedrock_agent, account, region, agent_id):
+    knowledge_bases = []
+    paginator = _bedrock_agent.get_paginator('list_agent_knowledge_bases')
+    for page in paginator.paginate(agentId=agent_id, agentVersion='DRAFT'):
+        knowledge_bases.extend(page.get('agentKnowledgeBaseSummaries', []))
+    return knowledge_bases, time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['knowledge_base_details'], show_spinner=False)
+def _fetch_knowledge_base_details(_bedrock_agent, account, region, kb_id):
+    response = _bedrock_agent.get_knowledge_base(knowledgeBaseId=kb_id)
+    return response.get('knowledgeBase'), time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['action_group_details'], show_spinner=False)
+def _fetch_action_group_details(_bedrock_agent, account, region, agent_id, agent_version, action_group_id):
+    response = _bedrock_agent.get_agent_action_group(
+        agentId=agent_id,
+        agentVersion=agent_version,
+        actionGroupId=action_group_id
+    )
+    return response.get('agentActionGroup'), time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['data_sources'], show_spinner=False)
+def _fetch_knowledge_base_data_sources(_bedrock_agent, account, region, kb_id):
+    data_sources = []
+    paginator = _bedrock_agent.get_paginator('list_data_sources')
+    for page in paginator.paginate(knowledgeBaseId=kb_id):
+        data_sources.extend(page.get('dataSourceSummaries', []))
+    return data_sources, time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['aliases'], show_spinner=False)
+def _fetch_agent_aliases(_bedrock_agent, account, region, agent_id):
+    aliases = []
+    paginator = _bedrock_agent.get_paginator('list_agent_aliases')
+    for page in paginator.paginate(agentId=agent_id):
+        aliases.extend(page.get('agentAliasSummaries', []))
+    return aliases, time.time()
+
+@st.cache_data(ttl=CACHE_TTLS['subagents'], show_spinner=False)
+def _fetch_agent_subagents(_bedrock_agent, account, region, agent_id):
+    response = _bedrock_agent.list_agent_collaborators(
+        agentId=agent_id,
+        agentVersion="DRAFT"
+    )
+    subagents = [
+        {"name": collaborator['collaboratorName'], "id": collaborator['collaboratorId']}
+        for collaborator in response["agentCollaboratorSummaries"]
+    ]
+    return subagents, time.time()
+
+class MetricsFetchError(Exception):
+    """Some metrics could not be fetched; carries the ones that could."""
+
+    def __init__(self, results, failures):
+        super().__init__(", ".join(failures))
+        self.results = results
+        self.failures = failures
+
+# Per-agent series requested from CloudWatch. Entries with an 'expression' are metric
+# math over the other series of the same agent, referenced by key.
+AGENT_METRIC_SERIES = [
+    {'key': 'inv', 'name': 'Invocations', 'metric': 'InvocationCount', 'stat': 'Sum', 'color': '#4CAF50'},
+    {'key': 'lat', 'name': 'Latency (ms)', 'metric': 'Latency', 'stat': 'Average', 'color': '#2196F3'},
+    {'key': 'p90', 'name': 'Latency p90 (ms)', 'metric': 'Latency', 'stat': 'p90', 'color': '#1976D2'},
+    {'key': 'p95', 'name': 'Latency p95 (ms)', 'metric': 'Latency', 'stat': 'p95', 'color': '#1565C0'},
+    {'key': 'p99', 'name': 'Latency p99 (ms)', 'metric': 'Latency', 'stat': 'p99', 'color': '#0D47A1'},
+    {'key': 'err', 'name': 'Errors', 'metric': 'ErrorCount', 'stat': 'Sum', 'color': '#F44336'},
+    {'key': 'rate', 'name': 'Error rate (%)', 'expression': 'IF(inv > 0, 100 * err / inv, 0)', 'color': '#FF9800'},
+]
+
+METRICS_NAMESPACE = 'AWS/Bedrock'
+
+# Selectable datapoint periods in seconds
+METRIC_PERIODS = {
+    '1 minute': 60,
+    '5 minutes': 300,
+    '1 hour': 3600,
+    '1 day': 86400,
+}
+
+# GetMetricData accepts at most 500 queries per request
+MAX_METRIC_QUERIES = 500
+
+def effective_period(days, period):
+    """Smallest period CloudWatch still retains for a window reaching back this many days."""
+    if days > 63:
+        return max(period, 3600)
+    if days > 15:
+        return max(period, 300)
+    return period
+
+def _metric_queries(agent_ids, period):
+    """GetMetricData queries for every agent; returns (queries, {query id: (agent id, series)})."""
+    queries = []
+    series_by_id = {}
+    for position, agent_id in enumerate(agent_ids):
+        prefix = f"a{position}_"
+        for series in AGENT_METRIC_SERIES:
+            query_id = prefix + series['key']
+            series_by_id[query_id] = (agent_id, series)
+            if 'expression' in series:
+                # Point the expression's series keys at this agent's queries
+                expression = re.sub(r'\b[a-z][a-z0-9]*\b', lambda match: prefix + match.group(0), series['expression'])
+                queries.append({'Id': query_id, 'Expression': expression, 'Label': series['name']})
+            else:
+                queries.append({
+                    'Id': query_id,
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': METRICS_NAMESPACE,
+                            'MetricName': series['metric'],
+                            'Dimensions': [{'Name': 'AgentId', 'Value': agent_id}],
+                        },
+                        'Period': period,
+                        'Stat': series['stat'],
+                    },
+                    'Label': series['name'],
+                })
+    return queries, series_by_id
+
+def _query_batches(queries):
+    # An expression must be sent with the series it refers to, so batches hold whole agents
+    per_agent = len(AGENT_METRIC_SERIES)
+    batch_size = (MAX_METRIC_QUERIES // per_agent) * per_agent
+    for start in range(0, len(queries), batch_size):
+        yield queries[start:start + batch_size]
+
+def _get_metric_data(cloudwatch, agent_ids, start_time, end_time, period):
+    """Run the batched GetMetricData requests for these agents and follow every NextToken.
+
+    Returns ([(agent id, series name, timestamp, value)], {failed series: message}).
+    """
+    queries, series_by_id = _metric_queries(agent_ids, period)
+    records = []
+    failures = {}
+    for batch in _query_batches(queries):
+        request = {
+            'MetricDataQueries': batch,
+            'StartTime': start_time,
+            'EndTime': end_time,
+            'ScanBy': 'TimestampAscending',
+        }
+        while True:
+            response = cloudwatch.get_metric_data(**request)
+            for result in response.get('MetricDataResults', []):
+                agent_id, series = series_by_id[result['Id']]
+                records.extend(
+                    (agent_id, series['name'], timestamp, value)
+                    for timestamp, value in zip(result.get('Timestamps', []), result.get('Values', []))
+                )
+                if result.get('StatusCode') in ('InternalError', 'Forbidden'):
+                    message = "; ".join(m.get('Value', '') for m in result.get('Messages', []))
+                    failures[f"{series['name']} for {agent_id}"] = message or result['StatusCode']
+            if not response.get('NextToken'):
+                break
+            request['NextToken'] = response['NextToken']
+    return records, failures
+
+@st.cache_data(ttl=CACHE_TTLS['metrics'], show_spinner=False)
+def _fetch_metrics(_cloudwatch, account, region, agent_ids, days, period):
+    """Every series for every agent, from as few GetMetricData requests as possible.
+
+    Returns ({agent id: {series name: {'timestamps', 'values', 'color'}}}, fetched at).
+    """
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=days)
+    records, failures = _get_metric_data(_cloudwatch, agent_ids, start_time, end_time, effective_period(days, period))
+
+    points = {(agent_id, series['name']): {} for agent_id in agent_ids for series in AGENT_METRIC_SERIES}
+    for agent_id, name, timestamp, value in records:
+        points[(agent_id, name)][timestamp] = value
+
+    results = {agent_id: {} for agent_id in agent_ids}
+    for series in AGENT_METRIC_SERIES:
+        for agent_id in agent_ids:
+            values = points[(agent_id, series['name'])]
+            timestamps = sorted(values)
+            results[agent_id][series['name']] = {
+                'timestamps': timestamps,
+                'values': [values[timestamp] for timestamp in timestamps],
+                'color': series['color'],
+            }
+
+    # A partial failure is retried on the next rerun rather than cached for the full TTL
+    if failures:
+        raise MetricsFetchError(results, failures)
+    return results, time.time()
+
+# Completed metric periods are kept on disk so the fleet view only fetches the newest window
+METRICS_HISTORY_DIR = os.path.expanduser(os.environ.get('REGISTRY_METRICS_CACHE') or '~/.cache/agent-registry')
+# Periods that ended less than this long ago may still receive late datapoints
+HISTORY_SETTLE_SECONDS = 600
+MAX_HISTORY_DAYS = 30
+HISTORY_COLUMNS = ['agent_id', 'series', 'timestamp', 'value']
+
+def _history_path(account, region, period):
+    return os.path.join(METRICS_HISTORY_DIR, f"metrics-{account}-{region}-{period}.json.gz")
+
+def _epoch_seconds(timestamps):
+    return (timestamps - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+
+def _load_history(path):
+    """Cached datapoints and, per agent, the [start, end) range they cover."""
+    # Plain JSON rather than pickle: the directory may be shared, and loading must not run code
+    try:
+        with gzip.open(path, 'rt') as f:
+            history = json.load(f)
+        points = pd.DataFrame(history['points'], columns=HISTORY_COLUMNS)
+        points['timestamp'] = pd.to_datetime(points['timestamp'], unit='s', utc=True)
+        points['value'] = points['value'].astype(float)
+        coverage = {
+            agent_id: (pd.Timestamp(start, unit='s', tz='UTC'), pd.Timestamp(end, unit='s', tz='UTC'))
+            for agent_id, (start, end) in history['coverage'].items()
+        }
+        return points, coverage
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # A corrupt or incompatible cache is rebuilt from CloudWatch
+        print(f"Ignoring metrics history {path}: {e}")
+    return pd.DataFrame(columns=HISTORY_COLUMNS), {}
+
+def _save_history(path, points, coverage):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    history = {
+        'points': {
+            'agent_id': points['agent_id'].tolist(),
+            'series': points['series'].tolist(),
+            'timestamp': _epoch_seconds(points['timestamp']).tolist(),
+            'value': points['value'].tolist(),
+        },
+        'coverage': {
+            agent_id: [int(start.timestamp()), int(end.timestamp())]
+            for agent_id, (start, end) in coverage.items()
+        },
+    }
+    # Write then rename, so concurrent sessions never read a partial file
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    with gzip.open(temporary, 'wt') as f:
+        json.dump(history, f)
+    os.replace(temporary, path)
+
+def _floor_time(timestamp, period):
+    return timestamp.floor(f"{period}s")
+
+@st.cache_data(ttl=CACHE_TTLS['metrics'], show_spinner=False)
+def _fetch_fleet_metrics(_cloudwatch, account, region, agent_ids, days, period):
+    """Datapoints of every series for every agent as a long frame (agent_id, series, timestamp, value).
+
+    Settled periods come from the local history; CloudWatch is only asked for what
+    follows each agent's cached range, or the whole window for agents not yet cached.
+    """
+    period = effective_period(days, period)
+    now = pd.Timestamp.now(tz='UTC')
+    window_start = _floor_time(now - pd.Timedelta(days=days), period)
+    settled_end = _floor_time(now - pd.Timedelta(seconds=HISTORY_SETTLE_SECONDS), period)
+    path = _history_path(account, region, period)
+    points, coverage = _load_history(path)
+
+    # Agents that need the same range share one batch of requests
+    starts = {}
+    for agent_id in agent_ids:
+        covered = coverage.get(agent_id)
+        start = covered[1] if covered and covered[0] <= window_start else window_start
+        starts.setdefault(start, []).append(agent_id)
+
+    records, failures = [], {}
+    for start, group in starts.items():
+        group_records, group_failures = _get_metric_data(
+            _cloudwatch, group, start.to_pydatetime(), now.to_pydatetime(), period
+        )
+        records.extend(group_records)
+        failures.update(group_failures)
+
+    fetched = pd.DataFrame(records, columns=HISTORY_COLUMNS)
+    fetched['timestamp'] = pd.to_datetime(fetched['timestamp'], utc=True)
+    fetched['value'] = fetched['value'].astype(float)
+    combined = pd.concat([points, fetched], ignore_index=True) if len(points) else fetched
+    combined = combined.drop_duplicates(['agent_id', 'series', 'timestamp'], keep='last')
+
+    if not failures:
+        history_start = _floor_time(now - pd.Timedelta(days=MAX_HISTORY_DAYS), period)
+        settled = combined[
+            (combined['timestamp'] + pd.Timedelta(seconds=period) <= settled_end)
+            & (combined['timestamp'] >= history_start)
+        ]
+        for start, group in starts.items():
+            for agent_id in group:
+                covered = coverage.get(agent_id)
+                covered_from = covered[0] if covered and covered[0] <= start else start
+                coverage[agent_id] = (max(covered_from, history_start), settled_end)
+        _save_history(path, settled.reset_index(drop=True), coverage)
+
+    frame = combined[combined['agent_id'].isin(agent_ids) & (combined['timestamp'] >= window_start)]
+    frame = frame.sort_values(['agent_id', 'series', 'timestamp']).reset_index(drop=True)
+    if failures:
+        raise MetricsFetchError(frame, failures)
+    return frame, time.time()
+
+CACHED_FETCHERS = [
+    _fetch_all_agents,
+    _fetch_agent_details,
+    _fetch_agent_action_groups,
+    _fetch_agent_knowledge_bases,
+    _fetch_knowledge_base_details,
+    _fetch_action_group_details,
+    _fetch_knowledge_base_data_sources,
+    _fetch_agent_aliases,
+    _fetch_agent_subagents,
+    _fetch_metrics,
+    _fetch_fleet_metrics,
+]
+
+def clear_data_cache():
+    """Drop every cached AWS response so the next rerun fetches fresh data."""
+    for fetcher in CACHED_FETCHERS:
+        fetcher.clear()
+    st.session_state.cache_fetched_at = {}
+
+def _region_of(client):
+    return client.meta.region_name
+
+def _account_of(client):
+    """Hashed access key ID the client signs with, so cached data never crosses accounts."""
+    credentials = client._get_credentials()
+    access_key = credentials.access_key if credentials else ''
+    return hashlib.sha256(access_key.encode()).hexdigest()[:16]
+
+@st.cache_resource(show_spinner=False)
+def get_fetch_executor():
+    """Thread pool shared by all sessions and reruns; each task runs with the script context of the session that queued it."""
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="registry-fetch")
+
+def _run_with_context(ctx, fetcher, args):
+    add_script_run_ctx(None, ctx)
+    return fetcher(*args)
+
+def prefetch(requests):
+    """Start (resource, fetcher, args) fetches concurrently for this rerun.
+
+    Each distinct request is started once per rerun; the get_* functions then wait
+    for the running fetch instead of calling AWS again.
+    """
+    inflight = st.session_state.setdefault('inflight_fetches', {})
+    ctx = get_script_run_ctx()
+    for resource, fetcher, args in requests:
+        key = (fetcher, args)
+        if key not in inflight:
+            inflight[key] = get_fetch_executor().submit(_run_with_context, ctx, fetcher, args)
+
+def _cached(resource, fetcher, *args):
+    """Call a cached fetcher and remember when its data was fetched from AWS."""
+    inflight = st.session_state.setdefault('inflight_fetches', {})
+    future = inflight.get((fetcher, args))
+    if future is None:
+        future = inflight[(fetcher, args)] = get_fetch_executor().submit(_run_with_context, get_script_run_ctx(), fetcher, args)
+    value, fetched_at = future.result()
+    fetched = st.session_state.setdefault('cache_fetched_at', {})
+    # Show the oldest data on screen for each kind of resource
+    fetched[resource] = min(fetched.get(resource, fetched_at), fetched_at)
+    return value
+
+def render_cache_ages(container):
+    """Summary of how old the cached data shown in this run is."""
+    fetched = st.session_state.get('cache_fetched_at', {})
+    snapshot, _ = get_registry_snapshot()
+    served = snapshot and st.session_state.get('snapshot_served')
+    if not fetched and not served:
+        return
+    now = time.time()
+    with container.expander("Data freshness"):
+        if served:
+            age = int(now - snapshot['created_at'].timestamp())
+            st.caption(f"Snapshot: {age // 3600}h {age % 3600 // 60}m old")
+        for resource, fetched_at in sorted(fetched.items()):
+            age = int(now - fetched_at)
+            st.caption(f"{resource.replace('_', ' ').capitalize()}: {age // 60}m {age % 60}s old "
+                       f"(refreshes every {CACHE_TTLS[resource] // 60}m)")
+
+# Registry snapshot (see registry_snapshot.py): agents unchanged since it was taken are
+# shown from it without describing them again. REGISTRY_OFFLINE=1 browses the snapshot
+# alone, without AWS credentials; metrics and agent tests are then unavailable.
+REGISTRY_SNAPSHOT = os.environ.get('REGISTRY_SNAPSHOT')
+REGISTRY_OFFLINE = os.environ.get('REGISTRY_OFFLINE', '0') == '1'
+
+@st.cache_resource(show_spinner=False)
+def _load_registry_snapshot(path, modified_at):
+    # Keyed on the modification time, so an exported snapshot is picked up on the next rerun
+    snapshot = registry_snapshot.load_snapshot(path)
+    return snapshot, registry_snapshot.records_by_id(snapshot)
+
+def get_registry_snapshot():
+    """The snapshot in use as (snapshot, records by agent ID); an opened file takes precedence."""
+    if st.session_state.get('opened_snapshot'):
+        return st.session_state.opened_snapshot
+    if not REGISTRY_SNAPSHOT:
+        return None, {}
+    
+    path = os.path.expanduser(REGISTRY_SNAPSHOT)
+    try:
+        return _load_registry_snapshot(path, os.path.getmtime(path))
+    except FileNotFoundError:
+        if REGISTRY_OFFLINE:
+            st.error(f"Registry snapshot {path} not found.")
+    except registry_snapshot.SnapshotError as e:
+        st.warning(f"Ignoring registry snapshot: {str(e)}")
+    return None, {}
+
+def snapshot_record(bedrock_agent, agent_id, versioned=True):
+    """The snapshot record to show an agent's data from, or None to fetch it live.
+
+    Offline every record is used. Online only resources versioned with the agent
+    (versioned=True) are taken from it, and only while the agent's updatedAt still
+    matches the live agent list.
+    """
+    _, records = get_registry_snapshot()
+    record = records.get(agent_id)
+    if record is None or not (REGISTRY_OFFLINE or versioned):
+        return None
+    if not REGISTRY_OFFLINE:
+        summary = next((agent for agent in st.session_state.get('agents') or [] if agent['agentId'] == agent_id), None)
+        if record['region'] != _region_of(bedrock_agent) or not registry_snapshot.is_current(record, summary):
+            return None
+    st.session_state.snapshot_served = True
+    return record
+
+def export_registry_snapshot(bedrock_agent):
+    """Snapshot of the current region merged into the one in use; returns (snapshot, errors)."""
+    previous, _ = get_registry_snapshot()
+    region = _region_of(bedrock_agent)
+    records, errors = registry_snapshot.collect_registry({region: bedrock_agent}, previous)
+    regions = [region]
+    embeddings = None
+    if previous:
+        # Other regions' agents are carried over; stored embeddings are checked against
+        # each agent's profile when loaded
+        records += [record for record in previous['agents'] if record['region'] != region]
+        regions = list(dict.fromkeys(previous['regions'] + regions))
+        embeddings = previous.get('embeddings')
+    return registry_snapshot.new_snapshot(records, regions, embeddings), errors
+
+def render_snapshot_controls(bedrock_agent):
+    """Sidebar panel to export the registry to a snapshot or browse a snapshot file."""
+    with st.expander("Registry snapshot"):
+        snapshot, records = get_registry_snapshot()
+        if snapshot:
+            st.caption(f"{len(records)} agents from {', '.join(snapshot['regions'])}, "
+                       f"taken {format_timestamp(snapshot['created_at'])}")
+        
+        if bedrock_agent and st.button("📦 Export snapshot"):
+            with st.spinner("Exporting registry..."):
+                snapshot, errors = export_registry_snapshot(bedrock_agent)
+            for name, error in errors.items():
+                st.warning(f"Could not export {name}: {error}")
+            if REGISTRY_SNAPSHOT:
+                registry_snapshot.save_snapshot(REGISTRY_SNAPSHOT, snapshot)
+                st.success(f"✅ Saved to {REGISTRY_SNAPSHOT}")
+            st.download_button("Download snapshot", registry_snapshot.dumps(snapshot),
+                               file_name="agent-registry.json.gz", mime="application/gzip")
+        
+        uploaded = st.file_uploader("Open a snapshot:", type=["gz"])
+        if uploaded is None:
+            st.session_state.opened_snapshot = None
+        else:
+            try:
+                opened = registry_snapshot.loads(uploaded.getvalue())
+                st.session_state.opened_snapshot = (opened, registry_snapshot.records_by_id(opened))
+            except registry_snapshot.SnapshotError as e:
+                st.error(str(e))
+
 def get_all_agents(bedrock_agent):
     """Get all Bedrock agents with pagination and caching."""
+    if REGISTRY_OFFLINE:
+        return [record['summary'] for record in get_registry_snapshot()[1].values()]
     if not bedrock_agent:
         return []
         
     try:
-        agents = []
-        paginator = bedrock_agent.get_paginator('list_agents')
-        
         with st.spinner("Loading agents..."):
-            for page in paginator.paginate():
-                agents.extend(page.get('agentSummaries', []))
-        
-        return agents
+            return _cached('agents', _fetch_all_agents, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent))
     except Exception as e:
         st.error(f"Error fetching agents: {str(e)}")
         return []
 
 def get_agent_details(bedrock_agent, agent_id):
     """Get detailed information about a specific agent."""
+    record = snapshot_record(bedrock_agent, agent_id)
+    if record:
+        return record['agent']
     if not bedrock_agent or not agent_id:
         return None
         
     try:
-        response = bedrock_agent.get_agent(agentId=agent_id)
-        return response.get('agent')
+        return _cached('agent_details', _fetch_agent_details, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), agent_id)
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'ResourceNotFoundException':
@@ -326,135 +843,146 @@ def get_agent_details(bedrock_agent, agent_id):
 
 def get_agent_action_groups(bedrock_agent, agent_id):
     """Get action groups associated with an agent."""
+    record = snapshot_record(bedrock_agent, agent_id)
+    if record:
+        return record['action_groups']
     if not bedrock_agent or not agent_id:
         return []
         
     try:
-        action_groups = []
-        paginator = bedrock_agent.get_paginator('list_agent_action_groups')
-        for page in paginator.paginate(agentId=agent_id, agentVersion='DRAFT'):
-            action_groups.extend(page.get('actionGroupSummaries', []))
-        return action_groups
+        return _cached('action_groups', _fetch_agent_action_groups, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), agent_id)
     except Exception as e:
         st.error(f"Error fetching action groups: {str(e)}")
         return []
 
 def get_agent_knowledge_bases(bedrock_agent, agent_id):
     """Get knowledge bases associated with an agent."""
+    record = snapshot_record(bedrock_agent, agent_id)
+    if record:
+        return record['knowledge_bases']
     if not bedrock_agent or not agent_id:
         return []
         
     try:
-        knowledge_bases = []
-        paginator = bedrock_agent.get_paginator('list_agent_knowledge_bases')
-        for page in paginator.paginate(agentId=agent_id, agentVersion='DRAFT'):
-            knowledge_bases.extend(page.get('agentKnowledgeBaseSummaries', []))
-        return knowledge_bases
+        return _cached('knowledge_bases', _fetch_agent_knowledge_bases, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), agent_id)
     except Exception as e:
         st.error(f"Error fetching knowledge bases: {str(e)}")
         return []
 
-def get_knowledge_base_details(bedrock_agent, kb_id):
+def get_knowledge_base_details(bedrock_agent, kb_id, agent_id=None):
     """Get details about a specific knowledge base."""
+    # Knowledge bases change independently of the agents using them: offline only
+    record = snapshot_record(bedrock_agent, agent_id, versioned=False)
+    if record:
+        return record['knowledge_base_details'].get(kb_id)
     if not bedrock_agent or not kb_id:
         return None
         
     try:
-        response = bedrock_agent.get_knowledge_base(knowledgeBaseId=kb_id)
-        return response
+        return _cached('knowledge_base_details', _fetch_knowledge_base_details, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), kb_id)
     except Exception as e:
         st.error(f"Error fetching knowledge base details: {str(e)}")
         return None
 
+def get_action_group_details(bedrock_agent, agent_id, action_group_id, agent_version='DRAFT'):
+    """Get an action group's full definition, including its API or function schema."""
+    record = snapshot_record(bedrock_agent, agent_id) if agent_version == registry_snapshot.AGENT_VERSION else None
+    if record:
+        return record['action_group_details'].get(action_group_id)
+    if not bedrock_agent or not agent_id or not action_group_id:
+        return None
+        
+    try:
+        return _cached('action_group_details', _fetch_action_group_details, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent),
+                       agent_id, agent_version, action_group_id)
+    except Exception as e:
+        st.warning(f"Could not fetch schema: {str(e)}")
+        return None
+
+def get_knowledge_base_data_sources(bedrock_agent, kb_id, agent_id=None):
+    """Get the data sources of a knowledge base."""
+    record = snapshot_record(bedrock_agent, agent_id, versioned=False)
+    if record:
+        return record['data_sources'].get(kb_id, [])
+    if not bedrock_agent or not kb_id:
+        return []
+        
+    try:
+        return _cached('data_sources', _fetch_knowledge_base_data_sources, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), kb_id)
+    except Exception as e:
+        st.warning(f"Could not fetch data sources: {str(e)}")
+        return []
+
+def render_action_group_schema(action_group_details):
+    """Show an action group's inline API schema, its S3 location, or its function definitions."""
+    api_schema = action_group_details.get('apiSchema', {})
+    if 'payload' in api_schema:
+        st.markdown("#### API Schema")
+        try:
+            st.code(json.dumps(json.loads(api_schema['payload']), indent=2), language='json')
+        except ValueError:
+            # Inline schemas may also be YAML
+            st.code(api_schema['payload'], language='yaml')
+    elif 's3' in api_schema:
+        st.markdown("#### API Schema")
+        location = api_schema['s3']
+        st.markdown(f"Stored in S3: `s3://{location.get('s3BucketName', '')}/{location.get('s3ObjectKey', '')}`")
+    
+    functions = action_group_details.get('functionSchema', {}).get('functions')
+    if functions:
+        st.markdown("#### Functions")
+        st.json(functions)
+
 def get_agent_aliases(bedrock_agent, agent_id):
     """Get all aliases associated with an agent."""
+    # Aliases can be updated without changing the agent: offline only
+    record = snapshot_record(bedrock_agent, agent_id, versioned=False)
+    if record:
+        return record['aliases']
     if not bedrock_agent or not agent_id:
         return []
         
     try:
-        aliases = []
-        paginator = bedrock_agent.get_paginator('list_agent_aliases')
-        for page in paginator.paginate(agentId=agent_id):
-            aliases.extend(page.get('agentAliasSummaries', []))
-        return aliases
+        return _cached('aliases', _fetch_agent_aliases, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), agent_id)
     except Exception as e:
         st.error(f"Error fetching agent aliases: {str(e)}")
         return []
 
-def get_agent_metrics(cloudwatch, agent_id, days=7):
-    """Get CloudWatch metrics for an agent with improved handling."""
-    if not cloudwatch or not agent_id:
+def get_agents_metrics(cloudwatch, agent_ids, days=7, period=86400):
+    """Get CloudWatch metrics for several agents, keyed by agent ID."""
+    if not cloudwatch or not agent_ids:
         return {}
         
     try:
-        end_time = datetime.utcnow()
-        start_time = end_time - timedelta(days=days)
-        
-        metrics = [
-            {
-                'name': 'Invocations',
-                'namespace': 'AWS/Bedrock',
-                'metric': 'InvocationCount',
-                'stat': 'Sum',
-                'dimensions': [{'Name': 'AgentId', 'Value': agent_id}],
-                'color': '#4CAF50'
-            },
-            {
-                'name': 'Latency (ms)',
-                'namespace': 'AWS/Bedrock',
-                'metric': 'Latency',
-                'stat': 'Average',
-                'dimensions': [{'Name': 'AgentId', 'Value': agent_id}],
-                'color': '#2196F3'
-            },
-            {
-                'name': 'Errors',
-                'namespace': 'AWS/Bedrock',
-                'metric': 'ErrorCount',
-                'stat': 'Sum',
-                'dimensions': [{'Name': 'AgentId', 'Value': agent_id}],
-                'color': '#F44336'
-            }
-        ]
-        
-        results = {}
-        for metric in metrics:
-            try:
-                response = cloudwatch.get_metric_statistics(
-                    Namespace=metric['namespace'],
-                    MetricName=metric['metric'],
-                    Dimensions=metric['dimensions'],
-                    StartTime=start_time,
-                    EndTime=end_time,
-                    Period=86400,  # Daily data points
-                    Statistics=[metric['stat']]
-                )
-                
-                datapoints = sorted(response.get('Datapoints', []), key=lambda x: x['Timestamp'])
-                
-                if datapoints:
-                    timestamps = [dp['Timestamp'] for dp in datapoints]
-                    values = [dp[metric['stat']] for dp in datapoints]
-                    
-                    results[metric['name']] = {
-                        'timestamps': timestamps,
-                        'values': values,
-                        'color': metric['color']
-                    }
-                else:
-                    results[metric['name']] = {
-                        'timestamps': [],
-                        'values': [],
-                        'color': metric['color']
-                    }
-            except Exception as e:
-                st.warning(f"Failed to fetch {metric['name']} metric: {str(e)}")
-                continue
+        return _cached('metrics', _fetch_metrics, cloudwatch, _account_of(cloudwatch), _region_of(cloudwatch), tuple(agent_ids), days, period)
+    except MetricsFetchError as e:
+        for name, error in e.failures.items():
+            st.warning(f"Failed to fetch {name} metric: {error}")
+        return e.results
+    except Exception as e:
+        st.warning(f"Could not fetch metrics: {str(e)}")
+        return {}
+
+def get_fleet_metrics(cloudwatch, agent_ids, days=7, period=86400):
+    """Get every agent's metric datapoints as a long frame, using the local history cache."""
+    if not cloudwatch or not agent_ids:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
         
-        return results
+    try:
+        return _cached('metrics', _fetch_fleet_metrics, cloudwatch, _account_of(cloudwatch), _region_of(cloudwatch), tuple(agent_ids), days, period)
+    except MetricsFetchError as e:
+        for name, error in e.failures.items():
+            st.warning(f"Failed to fetch {name} metric: {error}")
+        return e.results
     except Exception as e:
         st.warning(f"Could not fetch metrics: {str(e)}")
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+def get_agent_metrics(cloudwatch, agent_id, days=7, period=86400):
+    """Get CloudWatch metrics for an agent with improved handling."""
+    if not agent_id:
         return {}
+    return get_agents_metrics(cloudwatch, [agent_id], days, period).get(agent_id, {})
 
 def invoke_agent(bedrock_agent_runtime, agent_id, agent_alias_id, prompt):
     """Invoke an agent with a prompt and proper error handling."""
@@ -501,6 +1029,131 @@ def invoke_agent(bedrock_agent_runtime, agent_id, agent_alias_id, prompt):
         st.error(f"Error invoking agent: {str(e)}")
         return None
 
+def render_agent_metrics(metrics, days, period):
+    """Charts for one agent's metric series, as returned by get_agent_metrics."""
+    if not any(series['values'] for series in metrics.values()):
+        st.info(f"No metrics recorded for this agent in the last {days} days.")
+        return
+    
+    used_period = effective_period(days, period)
+    if used_period != period:
+        st.caption(f"Using {used_period // 60}-minute datapoints: CloudWatch keeps finer data for a shorter time.")
+    
+    def total(name):
+        return sum(metrics.get(name, {}).get('values', []))
+    
+    invocations, errors = total('Invocations'), total('Errors')
+    latency = metrics.get('Latency (ms)', {}).get('values', [])
+    summary1, summary2, summary3 = st.columns(3)
+    summary1.metric("Invocations", f"{invocations:,.0f}")
+    summary2.metric("Errors", f"{errors:,.0f}", f"{100 * errors / invocations:.1f}% of calls" if invocations else None,
+                    delta_color="inverse")
+    summary3.metric("Average latency", f"{sum(latency) / len(latency):,.0f} ms" if latency else "N/A")
+    
+    for title, names in (
+        ("Invocations", ['Invocations']),
+        ("Latency (ms)", ['Latency (ms)', 'Latency p90 (ms)', 'Latency p95 (ms)', 'Latency p99 (ms)']),
+        ("Errors", ['Errors', 'Error rate (%)']),
+    ):
+        figure = go.Figure()
+        for name in names:
+            series = metrics.get(name)
+            if series and series['values']:
+                figure.add_trace(go.Scatter(
+                    x=series['timestamps'], y=series['values'], name=name,
+                    mode='lines+markers', line=dict(color=series['color']),
+                    yaxis='y2' if name == 'Error rate (%)' else 'y',
+                ))
+        figure.update_layout(
+            title=title, height=320, margin=dict(l=10, r=10, t=40, b=10),
+            legend=dict(orientation='h'),
+            yaxis2=dict(overlaying='y', side='right', title='%', showgrid=False),
+        )
+        st.plotly_chart(figure)
+
+# Ranking choices on the fleet overview: label -> (column, sort descending)
+FLEET_RANKINGS = {
+    "Slowest p95 latency": ("p95 latency (ms)", True),
+    "Highest error rate": ("Error rate (%)", True),
+    "Most errors": ("Errors", True),
+    "Most invocations": ("Invocations", True),
+    "Fewest invocations": ("Invocations", False),
+}
+
+def fleet_summary(frame, agent_names):
+    """One row per agent with window totals and invocation-weighted latency figures."""
+    columns = ['Agent', 'Agent ID', 'Invocations', 'Errors', 'Error rate (%)',
+               'Avg latency (ms)', 'p95 latency (ms)', 'p99 latency (ms)']
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+    
+    wide = frame.pivot_table(index=['agent_id', 'timestamp'], columns='series', values='value')
+    wide = wide.reindex(columns=[series['name'] for series in AGENT_METRIC_SERIES])
+    invocations = wide['Invocations'].fillna(0)
+    
+    def weighted(name):
+        # Periods with more calls count for more; periods without calls are skipped
+        values = wide[name]
+        weights = invocations.where(values.notna(), 0)
+        totals = (values.fillna(0) * weights).groupby(level='agent_id').sum()
+        return totals / weights.groupby(level='agent_id').sum().replace(0, float('nan'))
+    
+    totals = wide[['Invocations', 'Errors']].groupby(level='agent_id').sum()
+    summary = pd.DataFrame({
+        'Invocations': totals['Invocations'],
+        'Errors': totals['Errors'],
+        'Error rate (%)': 100 * totals['Errors'] / totals['Invocations'].replace(0, float('nan')),
+        'Avg latency (ms)': weighted('Latency (ms)'),
+        'p95 latency (ms)': weighted('Latency p95 (ms)'),
+        'p99 latency (ms)': weighted('Latency p99 (ms)'),
+    })
+    summary.index.name = 'Agent ID'
+    summary = summary.reset_index()
+    summary.insert(0, 'Agent', summary['Agent ID'].map(agent_names).fillna(summary['Agent ID']))
+    return summary[columns]
+
+def render_fleet_overview(cloudwatch, agents, days, period):
+    """Compare every agent's invocations, latency and errors over the selected window."""
+    st.markdown("<h2 class='section-header'>Fleet Overview</h2>", unsafe_allow_html=True)
+    if not agents:
+        st.info("No agents to compare.")
+        return
+    
+    agent_names = {agent['agentId']: agent['agentName'] for agent in agents}
+    with st.spinner("Loading fleet metrics..."):
+        frame = get_fleet_metrics(cloudwatch, sorted(agent_names), days, period)
+    summary = fleet_summary(frame, agent_names)
+    if summary['Invocations'].fillna(0).sum() == 0:
+        st.info(f"No agent was invoked in the last {days} days.")
+        return
+    
+    total1, total2, total3 = st.columns(3)
+    total1.metric("Invocations", f"{summary['Invocations'].sum():,.0f}")
+    total2.metric("Errors", f"{summary['Errors'].sum():,.0f}")
+    total3.metric("Active agents", f"{(summary['Invocations'] > 0).sum()} of {len(summary)}")
+    
+    rank_col, count_col = st.columns([3, 1])
+    ranking = rank_col.selectbox("Rank agents by:", list(FLEET_RANKINGS))
+    top_n = count_col.number_input("Show top:", min_value=1, max_value=max(1, len(summary)), value=min(10, len(summary)))
+    column, descending = FLEET_RANKINGS[ranking]
+    ranked = summary.dropna(subset=[column]).sort_values(column, ascending=not descending).head(int(top_n))
+    
+    figure = px.bar(ranked, x=column, y='Agent', orientation='h', color=column, color_continuous_scale='Oranges')
+    figure.update_layout(height=max(250, 35 * len(ranked)), margin=dict(l=10, r=10, t=30, b=10),
+                         yaxis=dict(autorange='reversed'), coloraxis_showscale=False)
+    st.plotly_chart(figure)
+    st.caption("Latency figures are per-period values weighted by the invocations in each period.")
+    
+    # Column headers sort the full table
+    st.dataframe(summary, hide_index=True)
+    
+    invocations = frame[frame['series'] == 'Invocations'].groupby('timestamp')['value'].sum().reset_index()
+    if not invocations.empty:
+        figure = px.line(invocations, x='timestamp', y='value', labels={'timestamp': '', 'value': 'Invocations'},
+                         title="Fleet invocations")
+        figure.update_layout(height=300, margin=dict(l=10, r=10, t=40, b=10))
+        st.plotly_chart(figure)
+
 def format_timestamp(ts):
     """Format timestamp in a human-readable way."""
     if not ts:
@@ -512,23 +1165,17 @@ def format_timestamp(ts):
 
 def get_agent_subagents(bedrock_agent, agent_id):
     """Get subagents associated with an agent."""
+    record = snapshot_record(bedrock_agent, agent_id)
+    if record:
+        return [
+            {"name": collaborator['collaboratorName'], "id": collaborator['collaboratorId']}
+            for collaborator in record['collaborators']
+        ]
     if not bedrock_agent or not agent_id:
         return []
         
     try:
-        subagents = []
-        response = bedrock_agent.list_agent_collaborators(
-            agentId=agent_id,
-            agentVersion="DRAFT"
-        )
-
-        for collaborator in response["agentCollaboratorSummaries"]:
-            subagents.append({
-                "name": collaborator['collaboratorName'],
-                "id": collaborator['collaboratorId'],
-            })
-
-        return subagents
+        return _cached('subagents', _fetch_agent_subagents, bedrock_agent, _account_of(bedrock_agent), _region_of(bedrock_agent), agent_id)
     except Exception as e:
         st.error(f"Error fetching subagents: {str(e)}")
         return []
@@ -545,10 +1192,10 @@ def main():
     # Display header
     st.markdown("<h1 class='main-header'>🤖 Agent Registry</h1>", unsafe_allow_html=True)
     
-    # Get AWS credentials
-    access_key, secret_key, region = get_aws_credentials()
+    # Get AWS credentials; offline the snapshot is browsed without them
+    access_key, secret_key, region = (None, None, None) if REGISTRY_OFFLINE else get_aws_credentials()
     
-    if not access_key or not secret_key:
+    if not REGISTRY_OFFLINE and (not access_key or not secret_key):
         st.markdown(
             """
             <div class="warning-box">
@@ -564,13 +1211,21 @@ def main():
     # Initialize AWS clients
     bedrock_agent, bedrock_agent_runtime, bedrock, cloudwatch = initialize_clients(access_key, secret_key, region)
     
-    if not bedrock_agent:
+    if not bedrock_agent and not REGISTRY_OFFLINE:
         return
     
+    # Ages are collected afresh on every rerun from the data it displays, and
+    # identical fetches are shared within a rerun only
+    st.session_state.cache_fetched_at = {}
+    st.session_state.snapshot_served = False
+    st.session_state.inflight_fetches = {}
+    
     # Sidebar navigation
     with st.sidebar:
         st.markdown("<h3 class='sidebar-header'>Agent Navigator</h3>", unsafe_allow_html=True)
         
+        view = st.radio("View:", ["Agent details", "Fleet overview"], horizontal=True)
+        
         # Region selector
         regions = ['us-west-2', 'us-east-1', 'eu-central-1', 'eu-west-1']
         selected_region = st.selectbox("AWS Region:", regions, index=0)
@@ -579,6 +1234,7 @@ def main():
         if st.button("🔄 Refresh Agents"):
             # Clear cache to get fresh data
             print(selected_region)
+            clear_data_cache()
             st.session_state.agents = ''
             st.session_state.selected_agent =''
             bedrock_agent, bedrock_agent_runtime, bedrock, cloudwatch = initialize_clients(access_key, secret_key, selected_region)
@@ -612,18 +1268,53 @@ def main():
         st.markdown("---")
         st.markdown("### Metrics Settings")
         metrics_days = st.slider("Historical data (days):", 1, 30, 7)
+        period_label = st.selectbox("Datapoint period:", list(METRIC_PERIODS), index=len(METRIC_PERIODS) - 1)
+        metrics_period = METRIC_PERIODS[period_label]
+        
+        render_snapshot_controls(bedrock_agent)
+        
+        # Filled in once the page has loaded its data
+        freshness = st.container()
+    
+    if REGISTRY_OFFLINE:
+        st.info("📦 Offline: showing the registry snapshot. Metrics and agent tests need AWS access.")
+    
+    if view == "Fleet overview" and REGISTRY_OFFLINE:
+        st.info("The fleet overview needs CloudWatch and is not available offline.")
+        return
+    
+    if view == "Fleet overview":
+        render_fleet_overview(cloudwatch, st.session_state.agents, metrics_days, metrics_period)
+        render_cache_ages(freshness)
+        return
     
     # Main content area
     if st.session_state.selected_agent:
         agent_id = st.session_state.selected_agent
         
-        # Fetch all necessary data
+        # Fetch all necessary data; the calls are independent, so they run concurrently.
+        # Data of an agent unchanged since the snapshot is read from the snapshot instead
+        if not REGISTRY_OFFLINE:
+            agent_account, agent_region = _account_of(bedrock_agent), _region_of(bedrock_agent)
+            requests = [
+                ('aliases', _fetch_agent_aliases, (bedrock_agent, agent_account, agent_region, agent_id)),
+                ('metrics', _fetch_metrics, (cloudwatch, _account_of(cloudwatch), _region_of(cloudwatch), (agent_id,), metrics_days, metrics_period)),
+            ]
+            if not snapshot_record(bedrock_agent, agent_id):
+                requests += [
+                    ('agent_details', _fetch_agent_details, (bedrock_agent, agent_account, agent_region, agent_id)),
+                    ('action_groups', _fetch_agent_action_groups, (bedrock_agent, agent_account, agent_region, agent_id)),
+                    ('knowledge_bases', _fetch_agent_knowledge_bases, (bedrock_agent, agent_account, agent_region, agent_id)),
+                    ('subagents', _fetch_agent_subagents, (bedrock_agent, agent_account, agent_region, agent_id)),
+                ]
+            prefetch(requests)
         with st.spinner("Loading agent data..."):
             agent_details = get_agent_details(bedrock_agent, agent_id)
             action_groups = get_agent_action_groups(bedrock_agent, agent_id)
             knowledge_bases = get_agent_knowledge_bases(bedrock_agent, agent_id)
             agent_aliases = get_agent_aliases(bedrock_agent, agent_id)
-            metrics = get_agent_metrics(cloudwatch, agent_id, metrics_days)
+            subagents = get_agent_subagents(bedrock_agent, agent_id)
+            metrics = get_agent_metrics(cloudwatch, agent_id, metrics_days, metrics_period)
         
         if agent_details:
             # Agent header section
@@ -674,7 +1365,6 @@ def main():
                     st.metric("Knowledge Bases", len(knowledge_bases))
 
                 with metric3:
-                    subagents = get_agent_subagents(bedrock_agent, agent_id)
                     st.metric("Sub Agents", len(subagents))
                 
                 st.markdown("</div>", unsafe_allow_html=True)
@@ -696,9 +1386,6 @@ def main():
                 cap1, cap2, cap3 = st.columns(3)
                 
                 with cap1:
-                    # Get subagents for this agent
-                    
-                    subagents = get_agent_subagents(bedrock_agent, agent_id)
                     subagent_badge = "badge-green" if subagents else "badge-amber"
                     subagent_status = "Configured" if subagents else "Not Configured"
                     
@@ -756,29 +1443,25 @@ def main():
                 if not action_groups:
                     st.info("This agent has no configured action groups.")
                 else:
-                    for idx, action_group in enumerate(action_groups):
-                        with st.expander(f"{action_group['actionGroupName']}"):
+                    for action_group in action_groups:
+                        # Schemas are only fetched once their expander is opened
+                        expander = st.expander(f"{action_group['actionGroupName']}", on_change="rerun",
+                                               key=f"action_group_{agent_id}_{action_group['actionGroupId']}")
+                        with expander:
                             st.markdown(f"**ID:** `{action_group['actionGroupId']}`")
                             
                             if action_group.get('description'):
                                 st.markdown(f"**Description:** {action_group['description']}")
                             
-                            st.markdown(f"**Created:** {format_timestamp(action_group.get('createdAt'))}")
+                            st.markdown(f"**Updated:** {format_timestamp(action_group.get('updatedAt'))}")
                             
-                            # Try to get action group details and schema
-                            try:
-                                action_group_details = bedrock_agent.get_agent_action_group(
-                                    agentId=agent_id,
-                                    agentVersion='DRAFT',
-                                    actionGroupId=action_group['actionGroupId']
-                                )
-                                
-                                if 'apiSchema' in action_group_details:
-                                    st.markdown("#### API Schema")
-                                    schema = json.dumps(json.loads(action_group_details['apiSchema']), indent=2)
-                                    st.markdown(f"<pre class='code-block'>{schema}</pre>", unsafe_allow_html=True)
-                            except Exception as e:
-                                st.warning(f"Could not fetch schema: {str(e)}")
+                            if expander.open:
+                                with st.spinner("Loading schema..."):
+                                    action_group_details = get_action_group_details(
+                                        bedrock_agent, agent_id, action_group['actionGroupId']
+                                    )
+                                if action_group_details:
+                                    render_action_group_schema(action_group_details)
             
             with tabs[2]:  # Knowledge Bases tab
                 st.markdown("### Knowledge Bases")
@@ -787,11 +1470,22 @@ def main():
                     st.info("This agent has no associated knowledge bases.")
                 else:
                     for kb in knowledge_bases:
-                        with st.expander(f"{kb.get('knowledgeBaseName', kb['knowledgeBaseId'])}"):
-                            kb_id = kb['knowledgeBaseId']
-                            
-                            # Get knowledge base details
-                            kb_details = get_knowledge_base_details(bedrock_agent, kb_id)
+                        kb_id = kb['knowledgeBaseId']
+                        # Details and data sources are only fetched once the expander is opened
+                        expander = st.expander(f"{kb.get('knowledgeBaseName', kb_id)}", on_change="rerun",
+                                               key=f"knowledge_base_{agent_id}_{kb_id}")
+                        if not expander.open:
+                            continue
+                        
+                        with expander:
+                            if not REGISTRY_OFFLINE:
+                                prefetch([
+                                    ('knowledge_base_details', _fetch_knowledge_base_details, (bedrock_agent, agent_account, agent_region, kb_id)),
+                                    ('data_sources', _fetch_knowledge_base_data_sources, (bedrock_agent, agent_account, agent_region, kb_id)),
+                                ])
+                            with st.spinner("Loading knowledge base..."):
+                                kb_details = get_knowledge_base_details(bedrock_agent, kb_id, agent_id)
+                                data_sources = get_knowledge_base_data_sources(bedrock_agent, kb_id, agent_id)
                             
                             if kb_details:
                                 st.markdown(f"**ID:** `{kb_id}`")
@@ -806,32 +1500,27 @@ def main():
                                 st.markdown(f"**Storage Type:** {storage_type}")
                                 
                                 # Data sources
-                                try:
-                                    data_sources = bedrock_agent.list_knowledge_base_data_sources(
-                                        knowledgeBaseId=kb_id
-                                    )
+                                if data_sources:
+                                    st.markdown("#### Data Sources")
                                     
-                                    if data_sources.get('dataSourceSummaries'):
-                                        st.markdown("#### Data Sources")
-                                        
-                                        for ds in data_sources['dataSourceSummaries']:
-                                            st.markdown(
-                                                f"""
-                                                <div class='metric-card'>
-                                                    <h5>{ds.get('name', 'Unnamed Source')}</h5>
-                                                    <p><code>{ds.get('dataSourceId')}</code></p>
-                                                    <p>Status: {ds.get('status', 'Unknown')}</p>
-                                                </div>
-                                                """,
-                                                unsafe_allow_html=True
-                                            )
-                                except Exception as e:
-                                    st.warning(f"Could not fetch data sources: {str(e)}")
+                                    for ds in data_sources:
+                                        st.markdown(
+                                            f"""
+                                            <div class='metric-card'>
+                                                <h5>{ds.get('name', 'Unnamed Source')}</h5>
+                                                <p><code>{ds.get('dataSourceId')}</code></p>
+                                                <p>Status: {ds.get('status', 'Unknown')}</p>
+                                            </div>
+                                            """,
+                                            unsafe_allow_html=True
+                                        )
             
             with tabs[3]:  # Test Agent tab
                 st.markdown("### Test Your Agent")
                 
-                if not agent_aliases:
+                if REGISTRY_OFFLINE:
+                    st.info("Testing an agent needs AWS access and is not available offline.")
+                elif not agent_aliases:
                     st.error("This agent has no aliases. An alias is required to invoke the agent.")
                 else:
                     # Select an alias
@@ -899,6 +1588,13 @@ def main():
                     if st.session_state.test_conversation and st.button("Clear Conversation", key="clear_conversation"):
                         st.session_state.test_conversation = []
                         st.rerun()
+            
+            with tabs[4]:  # Metrics tab
+                st.markdown("### Performance Metrics")
+                if REGISTRY_OFFLINE:
+                    st.info("Metrics come from CloudWatch and are not available offline.")
+                else:
+                    render_agent_metrics(metrics, metrics_days, metrics_period)
     
         else:
             st.error("Failed to load agent details. Please try again or select a different agent.")
@@ -950,6 +1646,8 @@ def main():
             unsafe_allow_html=True
         )
 
+    render_cache_ages(freshness)
+
 # Run the app
 if __name__ == "__main__":
     main()
\ No newline at end of file
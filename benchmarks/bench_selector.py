@@ -0,0 +1,374 @@
+"""Routing benchmarks for BedrockAgentSelector.
+
+Drives the selector against in-process stand-ins for the bedrock-agent,
+bedrock-runtime and bedrock-agent-runtime clients, so results depend only on
+the selector code and the simulated per-call latency. Prints one JSON document
+per run; pass --compare with an earlier result to see the change per metric.
+
+    python benchmarks/bench_selector.py --sizes 10 100 1000 --latency-ms 5
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent_assistant'))
+import agentselector  # noqa: E402
+from agentselector import BedrockAgentSelector, InMemoryMetrics  # noqa: E402
+
+TOPICS = [
+    "billing invoices refunds payments",
+    "travel flights hotels bookings",
+    "weather forecasts storms temperature",
+    "code review pull requests python",
+    "security incidents vulnerabilities patching",
+    "database migrations indexes queries",
+    "networking dns load balancers",
+    "hr onboarding benefits payroll",
+    "marketing campaigns audiences analytics",
+    "legal contracts compliance policies",
+]
+
+
+class StubPaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        next_token = None
+        while True:
+            page = getattr(self.client, self.operation)(nextToken=next_token, **kwargs)
+            yield page
+            next_token = page.get('nextToken')
+            if not next_token:
+                return
+
+
+class StubClient:
+    """Base for the stub clients: counts calls and sleeps for the simulated latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class StubBedrockAgent(StubClient):
+    def __init__(self, agents, latency: float, page_size: int = 20):
+        super().__init__(latency)
+        self.agents = agents
+        self.page_size = page_size
+        self._by_id = {agent['agentId']: agent for agent in agents}
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def list_agents(self, nextToken=None, **kwargs):
+        self._call('list_agents')
+        start = int(nextToken or 0)
+        end = start + self.page_size
+        page = {
+            'agentSummaries': [
+                {
+                    'agentId': agent['agentId'],
+                    'agentName': agent['agentName'],
+                    'agentStatus': agent['agentStatus'],
+                    'description': agent['description'],
+                    'updatedAt': agent['lastUpdatedDateTime'],
+                }
+                for agent in self.agents[start:end]
+            ]
+        }
+        if end < len(self.agents):
+            page['nextToken'] = str(end)
+        return page
+
+    def get_agent(self, agentId):
+        self._call('get_agent')
+        return {'agent': dict(self._by_id[agentId])}
+
+    def list_agent_aliases(self, agentId, **kwargs):
+        self._call('list_agent_aliases')
+        return {
+            'agentAliasSummaries': [{
+                'agentAliasId': f"AL{agentId[-8:]}",
+                'agentAliasName': 'live',
+                'updatedAt': self._by_id[agentId]['lastUpdatedDateTime'],
+            }]
+        }
+
+    def list_agent_action_groups(self, agentId, agentVersion='DRAFT', nextToken=None, **kwargs):
+        self._call('list_agent_action_groups')
+        return {'actionGroupSummaries': [{
+            'actionGroupId': f"AG{agentId[-8:]}",
+            'actionGroupName': f"{self._by_id[agentId]['agentName']}_actions",
+        }]}
+
+
+class StubBedrockRuntime(StubClient):
+    """Titan stand-in: a bag-of-words embedding built from fixed per-word random vectors."""
+
+    def __init__(self, latency: float, dimensions: int = 1024):
+        super().__init__(latency)
+        self.dimensions = dimensions
+        self._word_vectors = {}
+
+    def _word_vector(self, word):
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._call('invoke_model')
+        text = json.loads(body)['inputText'] or ''
+        embedding = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            embedding += self._word_vector(word)
+        return {'body': io.BytesIO(json.dumps({'embedding': embedding.tolist()}).encode())}
+
+
+class StubBedrockAgentRuntime(StubClient):
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        self._call('invoke_agent')
+        latency = self.latency
+
+        def completion():
+            for word in f"{agentId} handled: {inputText}".split():
+                if latency:
+                    time.sleep(latency)
+                yield {'chunk': {'bytes': f"{word} ".encode()}}
+
+        return {'completion': completion(), 'sessionId': sessionId}
+
+
+def make_catalog(size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    agents = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)]
+        extra = " ".join(rng.choice(topic.split(), size=3))
+        agents.append({
+            'agentId': f"BENCH{i:08d}",
+            'agentName': f"agent-{i}",
+            'instruction': f"You answer questions about {topic}. Focus on {extra} for team {i % 97}.",
+            'description': f"Synthetic agent {i} for {topic.split()[0]}",
+            'agentStatus': 'PREPARED',
+            'foundationModel': 'anthropic.claude-3-haiku',
+            'creationDateTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+            'lastUpdatedDateTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        })
+    return agents
+
+
+def make_queries(count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in range(count):
+        topic = TOPICS[rng.integers(len(TOPICS))].split()
+        # Distinct queries so the query embedding cache does not hide embedding cost
+        queries.append(f"question {i}: help with {' '.join(rng.choice(topic, size=2))}")
+    return queries
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+    }
+
+
+def run_size(size: int, args) -> dict:
+    latency = args.latency_ms / 1000.0
+    clients = {
+        'bedrock-agent': StubBedrockAgent(make_catalog(size), latency),
+        'bedrock-runtime': StubBedrockRuntime(args.embed_latency_ms / 1000.0, args.dimensions),
+        'bedrock-agent-runtime': StubBedrockAgentRuntime(latency),
+    }
+
+    def client_factory(service_name, region_name=None, **kwargs):
+        return clients[service_name]
+
+    metrics = InMemoryMetrics()
+    if args.trace_memory:
+        tracemalloc.start()
+    with mock.patch.object(agentselector.boto3, 'client', client_factory):
+        cold_start = time.perf_counter()
+        selector = BedrockAgentSelector(max_workers=args.max_workers, index_mode=args.index_mode,
+                                        routing_mode=args.routing_mode, index_precision=args.index_precision,
+                                        metrics=metrics)
+
+        started = time.perf_counter()
+        selector.get_all_agents()
+        hydration = time.perf_counter() - started
+
+        started = time.perf_counter()
+        selector.warm_up()
+        embedding = time.perf_counter() - started
+        cold_start = time.perf_counter() - cold_start
+
+        queries = make_queries(args.queries)
+        runtime = clients['bedrock-runtime']
+        query_embeddings = [selector._get_embedding(query) for query in queries]
+
+        index = selector.agent_index
+        match_times = []
+        for query_embedding in query_embeddings:
+            started = time.perf_counter()
+            index.search(query_embedding, args.top_k)
+            match_times.append(time.perf_counter() - started)
+
+        query_times = []
+        for query in queries:
+            started = time.perf_counter()
+            selector.rank_agents(query, args.top_k)
+            query_times.append(time.perf_counter() - started)
+
+    peak_memory = None
+    if args.trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'agents': size,
+        'cold_start_s': cold_start,
+        'hydration_s': hydration,
+        'embedding_s': embedding,
+        'match': percentiles(match_times),
+        'query': percentiles(query_times),
+        'peak_memory_bytes': peak_memory,
+        # ru_maxrss is in KiB on Linux; it only ever grows, so runs share one high-water mark
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'index_bytes': index.memory_bytes(),
+        'index': index.stats(),
+        'calls': {**clients['bedrock-agent'].calls, **runtime.calls},
+        'routing': selector.get_routing_stats(),
+        'spans': span_summary(metrics),
+    }
+
+
+def span_summary(metrics: InMemoryMetrics) -> dict:
+    """Call count and mean duration per span, summed over regions and outcomes."""
+    totals = {}
+    for entry in metrics.snapshot():
+        total = totals.setdefault(entry['span'], {'count': 0, 'sum': 0.0})
+        total['count'] += entry['count']
+        total['sum'] += entry['sum']
+    return {span: {'count': total['count'], 'mean_ms': total['sum'] / total['count'] * 1000}
+            for span, total in totals.items()}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """Relative change of each timing metric against a previous run, per catalog size."""
+    baseline_runs = {run['agents']: run for run in baseline.get('runs', [])}
+    changes = []
+    for run in current['runs']:
+        previous = baseline_runs.get(run['agents'])
+        if previous is None:
+            continue
+        for metric in ('cold_start_s', 'hydration_s', 'embedding_s'):
+            changes.append((run['agents'], metric, previous[metric], run[metric]))
+        for group in ('match', 'query'):
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+                changes.append((run['agents'], f"{group}.{metric}", previous[group][metric], run[group][metric]))
+    return [
+        {'agents': agents, 'metric': metric, 'baseline': old, 'current': new,
+         'change': (new - old) / old if old else None}
+        for agents, metric, old, new in changes
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='catalog sizes to benchmark')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='simulated latency of each bedrock-agent and invoke_agent call')
+    parser.add_argument('--embed-latency-ms', type=float, default=0.0,
+                        help='simulated latency of each embedding call')
+    parser.add_argument('--queries', type=int, default=200, help='queries per catalog size')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--dimensions', type=int, default=1024, help='embedding dimensions')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--index-mode', choices=['exact', 'ivf'], default='exact')
+    parser.add_argument('--index-precision', choices=['float32', 'float16', 'int8'], default='float32')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record peak Python allocations with tracemalloc (slows every timing)')
+    parser.add_argument('--routing-mode', choices=['semantic', 'hybrid'], default='semantic')
+    parser.add_argument('--output', help='write the JSON result to this file as well as stdout')
+    parser.add_argument('--compare', help='earlier JSON result to compare against')
+    parser.add_argument('--fail-threshold', type=float,
+                        help='exit 1 if any p95 latency regresses by more than this fraction, e.g. 0.2')
+    args = parser.parse_args()
+
+    runs = [run_size(size, args) for size in args.sizes]
+
+    result = {
+        'benchmark': 'bedrock-agent-selector',
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'runs': runs,
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            result['comparison'] = compare(result, json.load(f))
+        if args.fail_threshold is not None:
+            regressions = [
+                change for change in result['comparison']
+                if change['metric'].endswith('p95_ms') and change['change'] is not None
+                and change['change'] > args.fail_threshold
+            ]
+            if regressions:
+                print(f"{len(regressions)} p95 regressions above {args.fail_threshold:.0%}", file=sys.stderr)
+                exit_code = 1
+
+    output = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,146 +1,2268 @@
+import asyncio
+import atexit
 import boto3
+import codecs
+import copy
+import hashlib
 import json
+import logging
+import math
+import os
+import re
+import time
+import threading
 import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 from typing import Dict, List, Any, Optional
-from botocore.exceptions import ClientError
 from uuid import uuid4
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import registry_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Titan Text Embeddings v2 accepts up to 50,000 characters (8,192 tokens); stay well inside it
+MAX_EMBEDDING_CHARS = 20000
+
+# Reciprocal rank fusion constant: damps the weight of the very top ranks
+RRF_K = 60
+
+DEFAULT_REGION = "us-west-2"
+
+# Seconds a multi-region load or refresh waits for each region before skipping it
+DEFAULT_REGION_TIMEOUT = 60.0
+
+
+def regions_from_env(default: str = DEFAULT_REGION) -> List[str]:
+    """Regions to federate: BEDROCK_AGENT_REGIONS (comma-separated), else AWS_REGION, else default."""
+    regions = [region.strip() for region in os.environ.get('BEDROCK_AGENT_REGIONS', '').split(',') if region.strip()]
+    return regions or [os.environ.get('AWS_REGION') or default]
+
+
+class _Span:
+    __slots__ = ('sink', 'name', 'labels', 'started')
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        labels = self.labels if exc_type is None else {**self.labels, 'outcome': 'error'}
+        self.sink.observe(self.name, time.perf_counter() - self.started, labels)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsSink:
+    """Receives timing spans from the selector. The base class discards them.
+
+    Subclass and implement observe() to forward spans elsewhere; leave enabled False
+    and span() hands out a shared no-op context manager, so disabled timing costs a
+    method call per span.
+    """
+
+    enabled = False
+
+    def span(self, name: str, **labels) -> Any:
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def observe(self, name: str, seconds: float, labels: Optional[Dict[str, str]] = None):
+        pass
+
+
+# Histogram bucket upper bounds in seconds, as used by Prometheus client libraries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class InMemoryMetrics(MetricsSink):
+    """Keeps a cumulative histogram per span name and label set.
+
+    to_prometheus() renders the Prometheus text exposition format and to_json() a
+    JSON document with counts, sums and bucket counts.
+    """
+
+    enabled = True
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, prefix: str = "agent_selector"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, labels: Optional[Dict[str, str]] = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.buckets)}
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][position] += 1
+                    break
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """One entry per span and label set with count, sum and cumulative bucket counts."""
+        with self._lock:
+            histograms = [(key, dict(histogram, buckets=list(histogram['buckets']))) for key, histogram in self._histograms.items()]
+
+        entries = []
+        for (name, labels), histogram in sorted(histograms):
+            cumulative = np.cumsum(histogram['buckets']).tolist()
+            entries.append({
+                'span': name,
+                'labels': dict(labels),
+                'count': histogram['count'],
+                'sum': histogram['sum'],
+                'mean': histogram['sum'] / histogram['count'],
+                'buckets': dict(zip(map(str, self.buckets), cumulative)),
+            })
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def to_json(self) -> str:
+        return json.dumps({'spans': self.snapshot()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        metric = f"{self.prefix}_span_seconds"
+        lines = [f"# HELP {metric} Time spent in agent selector spans.", f"# TYPE {metric} histogram"]
+        for entry in self.snapshot():
+            labels = {'span': entry['span'], **entry['labels']}
+            label_text = ",".join(f'{key}="{self._escape(value)}"' for key, value in labels.items())
+            for bound, count in entry['buckets'].items():
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {entry["count"]}')
+            lines.append(f'{metric}_sum{{{label_text}}} {entry["sum"]}')
+            lines.append(f'{metric}_count{{{label_text}}} {entry["count"]}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _escape(value: Any) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class EmbeddingError(Exception):
+    """Raised when text cannot be embedded, after retrying throttled calls."""
+
+
+@contextmanager
+def _file_lock(path: str, shared: bool = False):
+    """Hold an advisory lock on path across processes (shared locks only where supported)."""
+    with open(path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class EmbeddingStore:
+    """Persistent, content-addressed store of embedding vectors, shareable between processes.
+
+    Vectors live in a memory-mapped float32 array (vectors.npy) and index.json maps
+    sha256(model id, text) to a row and the time it was added, so text that has been
+    embedded once is never sent to the embedding model again.
+
+    Writes are buffered and published in batches under an exclusive lock on store.lock:
+    the writer re-reads the index, appends its rows after the last published one and
+    replaces the index. A published row is never rewritten in place; growing or
+    compacting the store writes a new vector file, so readers holding the previous index
+    keep reading the vectors it describes. A miss re-reads the index if another process
+    has published since.
+
+    With max_entries or ttl_seconds set, expired entries are not returned and a flush
+    that finds the store over max_entries, or a tenth of it expired, compacts it,
+    dropping expired and then the oldest entries.
+    """
+
+    # Buffered vectors are published once this many are pending, or on the first put
+    # flush_interval seconds after the oldest of them
+    flush_every = 64
+    flush_interval = 5.0
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(self.path, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._vectors_path = os.path.join(self.path, 'vectors.npy')
+        self._index_path = os.path.join(self.path, 'index.json')
+        self._lock_path = os.path.join(self.path, 'store.lock')
+        self._lock = threading.Lock()
+
+        # key -> (row, added at), as of the index last read or written
+        self._keys = {}
+        self._rows = 0
+        self._dim = None
+        self._vectors = None
+        self._index_stamp = None
+        self._pending = {}
+        self._pending_since = None
+        with self._lock, _file_lock(self._lock_path, shared=True):
+            self._reload()
+        # Buffered vectors are published when the process exits
+        atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(model_id: str, text: str) -> str:
+        return hashlib.sha256(f"{model_id}\x00{text}".encode('utf-8')).hexdigest()
+
+    def _stamp(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        """Re-read the published index and vector file if either changed; call under the file lock."""
+        stamp = self._stamp()
+        if stamp == self._index_stamp or stamp is None or not os.path.exists(self._vectors_path):
+            return
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            vectors = np.load(self._vectors_path, mmap_mode='r+')
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable embedding store at %s: %s", self.path, e)
+            return
+
+        if vectors.ndim != 2 or vectors.shape[1] != index.get('dim'):
+            logger.warning("Ignoring embedding store at %s: vector file does not match its index", self.path)
+            return
+
+        keys = {}
+        for key, entry in index.get('keys', {}).items():
+            # Indexes written before entries carried their age count as added now
+            row, added_at = (entry, time.time()) if isinstance(entry, int) else entry
+            # Rows past the end of the vector file were never fully written
+            if row < vectors.shape[0]:
+                keys[key] = (row, added_at)
+        self._dim = index['dim']
+        self._vectors = vectors
+        self._keys = keys
+        self._rows = index.get('rows', max((row for row, _ in keys.values()), default=-1) + 1)
+        self._index_stamp = stamp
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._pending)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pending or key in self._keys
+
+    def _expired(self, added_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and added_at < now - self.ttl_seconds
+
+    def get(self, model_id: str, text: str) -> Optional[np.ndarray]:
+        key = self.make_key(model_id, text)
+        with self._lock:
+            vector = self._pending.get(key)
+            if vector is not None:
+                return vector.copy()
+
+            entry = self._keys.get(key)
+            if entry is None and self._stamp() != self._index_stamp:
+                # Another process may have published it since the index was read
+                with _file_lock(self._lock_path, shared=True):
+                    self._reload()
+                entry = self._keys.get(key)
+            if entry is None or self._expired(entry[1], time.time()):
+                return None
+            return np.array(self._vectors[entry[0]])
+
+    def put(self, model_id: str, text: str, vector: np.ndarray, flush: bool = True):
+        """Buffer a vector; it is published now with flush=True, else with the next batch."""
+        vector = np.asarray(vector, dtype=np.float32)
+        key = self.make_key(model_id, text)
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = vector.shape[0]
+            if vector.shape != (self._dim,):
+                logger.warning("Not storing embedding of dimension %d in a store of dimension %d",
+                               vector.shape[0], self._dim)
+                return
+
+            self._pending[key] = vector
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            due = (len(self._pending) >= self.flush_every
+                   or time.monotonic() - self._pending_since >= self.flush_interval)
+
+        if flush or due:
+            self.flush()
+
+    def _ensure_capacity(self, rows: int):
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows <= capacity:
+            return
+
+        # Grow geometrically so appends stay amortised O(1)
+        self._write_vectors(max(rows, 2 * capacity, 64), self._vectors[:self._rows] if capacity else None)
+
+    def _write_vectors(self, capacity: int, rows: Optional[np.ndarray]):
+        """Replace the vector file with a new one holding rows, leaving readers of the old file undisturbed."""
+        tmp_path = self._vectors_path + '.tmp'
+        vectors = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(capacity, self._dim))
+        if rows is not None and len(rows):
+            vectors[:len(rows)] = rows
+        vectors.flush()
+        del vectors
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode='r+')
+
+    def _needs_compaction(self, now: float) -> bool:
+        if self.max_entries is not None and len(self._keys) > self.max_entries:
+            return True
+        if self.ttl_seconds is None:
+            return False
+        expired = sum(1 for _, added_at in self._keys.values() if self._expired(added_at, now))
+        return expired > 0 and expired >= len(self._keys) // 10
+
+    def _compact(self, now: float):
+        entries = [(key, row, added_at) for key, (row, added_at) in self._keys.items()
+                   if not self._expired(added_at, now)]
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            # Keep the newest entries, with headroom so the next flushes don't compact again
+            entries.sort(key=lambda entry: entry[2])
+            entries = entries[len(entries) - int(self.max_entries * 0.9):]
+
+        rows = np.array([entry[1] for entry in entries], dtype=np.int64)
+        self._write_vectors(max(len(entries), 64), self._vectors[rows] if len(rows) else None)
+        self._keys = {key: (row, added_at) for row, (key, _, added_at) in enumerate(entries)}
+        self._rows = len(entries)
+
+    def flush(self):
+        """Publish buffered vectors: append them under the file lock, then atomically replace the index."""
+        with self._lock:
+            if not self._pending:
+                return
+            with _file_lock(self._lock_path):
+                self._reload()
+                if self._vectors is not None and self._vectors.shape[1] != self._dim:
+                    logger.warning("Dropping %d embeddings of dimension %d: the store at %s holds dimension %d",
+                                   len(self._pending), self._dim, self.path, self._vectors.shape[1])
+                    self._pending, self._pending_since = {}, None
+                    return
+
+                now = time.time()
+                # Another process may have published some of the same texts meanwhile
+                pending = [(key, vector) for key, vector in self._pending.items() if key not in self._keys]
+                if pending:
+                    self._ensure_capacity(self._rows + len(pending))
+                    for offset, (key, vector) in enumerate(pending):
+                        self._vectors[self._rows + offset] = vector
+                        self._keys[key] = (self._rows + offset, now)
+                    self._rows += len(pending)
+
+                if self._needs_compaction(now):
+                    self._compact(now)
+                elif self._vectors is not None:
+                    self._vectors.flush()
+
+                tmp_path = self._index_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'dim': self._dim, 'rows': self._rows, 'keys': self._keys}, f)
+                os.replace(tmp_path, self._index_path)
+                self._index_stamp = self._stamp()
+            self._pending, self._pending_since = {}, None
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query embeddings with TTL expiry.
+
+    Keys combine the embedding model id with the query lower-cased and with whitespace
+    collapsed. An optional EmbeddingStore is consulted on a memory miss, so hot queries
+    are shared between processes and survive restarts.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600, disk_store: Optional[EmbeddingStore] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.disk_store = disk_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, model_id: str, query: str) -> Optional[np.ndarray]:
+        key = (model_id, self.normalize(query))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+                self.expirations += 1
+
+        embedding = self.disk_store.get(model_id, key[1]) if self.disk_store is not None else None
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, embedding, now)
+        return embedding
+
+    def put(self, model_id: str, query: str, embedding: np.ndarray):
+        key = (model_id, self.normalize(query))
+        self._remember(key, embedding, time.monotonic())
+        if self.disk_store is not None:
+            # Published with the store's next batch; this process reads it from the buffer until then
+            self.disk_store.put(model_id, key[1], embedding, flush=False)
+
+    def _remember(self, key: tuple, embedding: np.ndarray, now: float):
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of agent answers for repeated, idempotent questions.
+
+    Entries are keyed by (agentId, aliasId, normalized query) and expire after the
+    agent's TTL (agent_ttls, falling back to default_ttl; a TTL of 0 disables caching
+    for that agent). Each entry remembers the agent's lastUpdatedDateTime and the
+    alias's updatedAt, so an answer is never served once either has changed.
+    """
+
+    def __init__(self, max_size: int = 512, default_ttl: float = 300, agent_ttls: Optional[Dict[str, float]] = None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.agent_ttls = dict(agent_ttls or {})
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _version(agent: Dict[str, Any], alias_id: str) -> tuple:
+        alias_updated = next(
+            (alias.get('updatedAt') for alias in agent.get('aliases') or [] if alias.get('agentAliasId') == alias_id),
+            None,
+        )
+        return (agent.get('last_updated'), alias_updated)
+
+    def ttl_for(self, agent_id: str) -> float:
+        return self.agent_ttls.get(agent_id, self.default_ttl)
+
+    def get(self, agent: Dict[str, Any], alias_id: str, query: str) -> Optional[str]:
+        key = (agent['agentId'], alias_id, QueryEmbeddingCache.normalize(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, version, response = entry
+            if expires_at <= time.monotonic() or version != self._version(agent, alias_id):
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, agent: Dict[str, Any], alias_id: str, query: str, response: str):
+        ttl = self.ttl_for(agent['agentId'])
+        if ttl <= 0 or not response:
+            return
+
+        key = (agent['agentId'], alias_id, QueryEmbeddingCache.normalize(query))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, self._version(agent, alias_id), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def agent_ids(self) -> set:
+        """IDs of the agents that currently have cached answers."""
+        with self._lock:
+            return {key[0] for key in self._entries}
+
+    def invalidate(self, agent_id: Optional[str] = None):
+        """Drop every cached answer, or only those from one agent."""
+        with self._lock:
+            keys = [key for key in self._entries if agent_id is None or key[0] == agent_id]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class AgentHealth:
+    """Rolling invocation statistics per (agent, alias), updated by every invoke_agent call.
+
+    Latency, time to first chunk and error rate are exponentially weighted moving
+    averages; alpha is the weight of the newest sample.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _average(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else self.alpha * sample + (1 - self.alpha) * current
+
+    def record(self, agent_id: str, alias_id: str, latency: Optional[float] = None,
+               first_chunk: Optional[float] = None, error: bool = False):
+        """Add one invocation; latency is None when the stream was not read to the end."""
+        with self._lock:
+            stats = self._stats.setdefault((agent_id, alias_id), {
+                'agent_id': agent_id, 'alias_id': alias_id, 'calls': 0, 'errors': 0,
+                'error_rate': None, 'latency': None, 'first_chunk': None, 'updated_at': None,
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['error_rate'] = self._average(stats['error_rate'], 1.0 if error else 0.0)
+            if latency is not None:
+                stats['latency'] = self._average(stats['latency'], latency)
+            if first_chunk is not None:
+                stats['first_chunk'] = self._average(stats['first_chunk'], first_chunk)
+            stats['updated_at'] = time.time()
+
+    def get(self, agent_id: str, alias_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stats = self._stats.get((agent_id, alias_id))
+            return dict(stats) if stats else None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(stats) for stats in self._stats.values()]
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _confidence(entry: Dict[str, Any]) -> float:
+    # Hybrid entries are ranked by a fused rank score; thresholds and margins are on the similarity scale
+    return entry.get("confidence", entry["score"])
+
+
+class HealthPolicy:
+    """Breaks near-ties in a ranking in favour of healthier, faster agents.
+
+    Leading candidates scoring within tie_margin of the best are reordered by a
+    penalty of error_weight * error rate plus latency_weight * how much slower than
+    the fastest of them they are, as a fraction of the slowest (time to first chunk
+    when use_first_chunk is set). Agents
+    with fewer than min_calls recorded calls get no penalty. Subclass and override
+    penalty() for a different policy.
+    """
+
+    def __init__(self, tie_margin: float = 0.02, error_weight: float = 1.0, latency_weight: float = 0.5,
+                 use_first_chunk: bool = True, min_calls: int = 3, candidates: int = 5):
+        self.tie_margin = tie_margin
+        self.error_weight = error_weight
+        self.latency_weight = latency_weight
+        self.use_first_chunk = use_first_chunk
+        self.min_calls = min_calls
+        # Candidates ranked before breaking ties, even when fewer are requested
+        self.candidates = candidates
+
+    def _latency(self, stats: Optional[Dict[str, Any]]) -> Optional[float]:
+        if stats is None or stats['calls'] < self.min_calls:
+            return None
+        if self.use_first_chunk and stats['first_chunk'] is not None:
+            return stats['first_chunk']
+        return stats['latency']
+
+    def penalty(self, stats: Optional[Dict[str, Any]], fastest: Optional[float], slowest: Optional[float]) -> float:
+        if stats is None or stats['calls'] < self.min_calls:
+            return 0.0
+        latency = self._latency(stats)
+        relative_latency = (latency - fastest) / slowest if latency and slowest else 0.0
+        return self.error_weight * stats['error_rate'] + self.latency_weight * relative_latency
+
+    def rerank(self, ranked: List[Dict], health: AgentHealth) -> List[Dict]:
+        if len(ranked) < 2:
+            return ranked
+        best = _confidence(ranked[0])
+        tied = 1
+        while tied < len(ranked) and best - _confidence(ranked[tied]) <= self.tie_margin:
+            tied += 1
+        if tied < 2:
+            return ranked
+
+        stats = [health.get(entry["agent"]["agentId"], entry["agent"]["defaultAliasId"]) for entry in ranked[:tied]]
+        latencies = [latency for latency in map(self._latency, stats) if latency]
+        fastest, slowest = (min(latencies), max(latencies)) if latencies else (None, None)
+        for entry, agent_stats in zip(ranked[:tied], stats):
+            entry["health_penalty"] = self.penalty(agent_stats, fastest, slowest)
+        # Stable sort: equal penalties keep their ranking order
+        return sorted(ranked[:tied], key=lambda entry: entry["health_penalty"]) + ranked[tied:]
+
+
+class SessionManager:
+    """Pins caller conversations to an (agent, alias, sessionId) triple.
+
+    Follow-up messages in a conversation reuse the pinned agent and its Bedrock session,
+    so the agent keeps its session memory and the query is not routed again. Pins
+    expire after idle_timeout seconds without use; the oldest are evicted past max_sessions.
+    """
+
+    def __init__(self, idle_timeout: float = 1800, max_sessions: int = 10000):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Return the live pin for a conversation, refreshing its idle timer."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return None
+            if now - session['last_used'] > self.idle_timeout:
+                del self._sessions[conversation_id]
+                return None
+            session['last_used'] = now
+            self._sessions.move_to_end(conversation_id)
+            return session
+
+    def pin(self, conversation_id: str, agent: Dict[str, Any]) -> Dict[str, Any]:
+        """Start a new Bedrock session for the conversation with this agent."""
+        session = {
+            'agent_id': agent['agentId'],
+            'alias_id': agent['defaultAliasId'],
+            'session_id': str(uuid4()),
+            'last_used': time.monotonic(),
+        }
+        with self._lock:
+            self._sessions[conversation_id] = session
+            self._sessions.move_to_end(conversation_id)
+            self._evict(session['last_used'])
+        return session
+
+    def end(self, conversation_id: str):
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+    def _evict(self, now: float):
+        # Least recently used pins sit at the front
+        while self._sessions:
+            conversation_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session['last_used'] <= self.idle_timeout:
+                break
+            del self._sessions[conversation_id]
+
+
+INDEX_PRECISIONS = ("float32", "float16", "int8")
+
+
+class EmbeddingIndex:
+    """Agent embeddings kept as one row-normalized matrix.
+
+    Cosine similarity against every agent is then a single matrix-vector product,
+    and only the top-k rows are sorted.
+
+    precision="float16" halves the matrix and "int8" quarters it, storing each row
+    as int8 codes with a float32 scale. Quantized rows are scored in blocks without
+    keeping a full-precision copy; build() measures how closely the quantized ranking
+    agrees with full-precision scoring (see stats()).
+    """
+
+    # Quantized rows are widened to float32 this many at a time while scoring;
+    # small blocks keep the widened copy in cache
+    block_rows = 256
+
+    def __init__(self, precision: str = "float32", agreement_queries: int = 64, agreement_top_k: int = 10):
+        if precision not in INDEX_PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(INDEX_PRECISIONS)}")
+        self.precision = precision
+        self.agreement_queries = agreement_queries
+        self.agreement_top_k = agreement_top_k
+        self.ids = []
+        self._rows = {}
+        self.matrix = None
+        # Per-row dequantization factors for int8 storage
+        self.scales = None
+        self.agreement = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._rows
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        # Zero vectors stay zero and score 0 against everything
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def _encode(self, vectors: np.ndarray) -> tuple:
+        """Normalize rows and convert them to the storage precision: (codes, scales)."""
+        vectors = self._normalize(vectors)
+        if self.precision == "float16":
+            return vectors.astype(np.float16), None
+        if self.precision == "int8":
+            scales = np.abs(vectors).max(axis=-1) / 127
+            safe = np.where(scales > 0, scales, 1)[..., np.newaxis]
+            return np.rint(vectors / safe).astype(np.int8), scales.astype(np.float32)
+        return vectors, None
+
+    def vectors(self, rows=None) -> np.ndarray:
+        """Stored rows widened back to float32 (all rows when rows is None)."""
+        codes = self.matrix if rows is None else self.matrix[rows]
+        if self.precision == "float32":
+            return codes
+        vectors = codes.astype(np.float32)
+        if self.scales is not None:
+            vectors *= (self.scales if rows is None else self.scales[rows])[..., np.newaxis]
+        return vectors
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Dot products of a normalized float32 query with the stored rows."""
+        if self.precision == "float32":
+            return (self.matrix if rows is None else self.matrix[rows]) @ query
+
+        size = len(self.ids) if rows is None else len(rows)
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, self.block_rows):
+            block = slice(start, start + self.block_rows)
+            codes = self.matrix[block] if rows is None else self.matrix[rows[block]]
+            scores[block] = codes.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def build(self, embeddings: Dict[str, np.ndarray]):
+        self.ids = list(embeddings)
+        self._rows = {agent_id: row for row, agent_id in enumerate(self.ids)}
+        self.matrix = self.scales = self.agreement = None
+        if not self.ids:
+            return
+
+        vectors = np.stack([embeddings[agent_id] for agent_id in self.ids])
+        self.matrix, self.scales = self._encode(vectors)
+        if self.precision != "float32" and self.agreement_queries > 0:
+            self.agreement = self.measure_agreement(vectors, self._probe_queries(vectors), self.agreement_top_k)
+
+    def _probe_queries(self, vectors: np.ndarray) -> np.ndarray:
+        # Blends of two random agents, weighted towards the first: queries that sit
+        # between profiles are where rounding error is most likely to reorder the ranking
+        rng = np.random.default_rng(0)
+        count = min(self.agreement_queries, len(vectors))
+        normalized = self._normalize(vectors)
+        weights = rng.uniform(0.55, 0.8, size=(count, 1)).astype(np.float32)
+        first = normalized[rng.integers(len(vectors), size=count)]
+        second = normalized[rng.integers(len(vectors), size=count)]
+        return weights * first + (1 - weights) * second
+
+    def measure_agreement(self, vectors: np.ndarray, queries: np.ndarray, top_k: int = 10) -> Dict[str, float]:
+        """Compare the stored ranking with full-precision scoring of vectors (rows in index order).
+
+        Returns the fraction of queries with the same best agent ("top1") and the
+        fraction of the full-precision top_k found in the stored top_k ("overlap").
+        """
+        exact = self._normalize(vectors)
+        same_best = found = total = 0
+        for query in np.atleast_2d(queries):
+            query = self._normalize(query)
+            reference = self._top_k(exact @ query, top_k)
+            stored = self._top_k(self._scores(query), top_k)
+            same_best += int(len(stored) > 0 and stored[0] == reference[0])
+            found += len(set(reference.tolist()) & set(stored.tolist()))
+            total += len(reference)
+        queries_run = len(np.atleast_2d(queries))
+        return {
+            'top1': same_best / queries_run if queries_run else 1.0,
+            'overlap': found / total if total else 1.0,
+            'queries': queries_run,
+            'top_k': top_k,
+        }
+
+    def memory_bytes(self) -> int:
+        if self.matrix is None:
+            return 0
+        return int(self.matrix.nbytes + (0 if self.scales is None else self.scales.nbytes))
+
+    def stats(self) -> Dict[str, Any]:
+        """Storage precision, size in bytes (and the float32 equivalent) and measured agreement."""
+        dimensions = 0 if self.matrix is None else self.matrix.shape[1]
+        return {
+            'precision': self.precision,
+            'rows': len(self.ids),
+            'dimensions': dimensions,
+            'memory_bytes': self.memory_bytes(),
+            'float32_bytes': len(self.ids) * dimensions * 4,
+            'agreement': self.agreement,
+        }
+
+    def upsert(self, agent_id: str, vector: np.ndarray):
+        code, scale = self._encode(vector)
+        row = self._rows.get(agent_id)
+        if row is not None:
+            self.matrix[row] = code
+            if scale is not None:
+                self.scales[row] = scale
+            return
+        self._rows[agent_id] = len(self.ids)
+        self.ids.append(agent_id)
+        self.matrix = code[np.newaxis, :] if self.matrix is None else np.vstack([self.matrix, code])
+        if scale is not None:
+            self.scales = np.atleast_1d(scale) if self.scales is None else np.append(self.scales, scale)
+
+    def remove(self, agent_id: str):
+        row = self._rows.pop(agent_id, None)
+        if row is None:
+            return
+        # Move the last row into the hole so rows stay contiguous
+        last = len(self.ids) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            if self.scales is not None:
+                self.scales[row] = self.scales[last]
+            self.ids[row] = self.ids[last]
+            self._rows[self.ids[row]] = row
+        self.ids.pop()
+        self.matrix = self.matrix[:last] if last else None
+        if self.scales is not None:
+            self.scales = self.scales[:last] if last else None
+
+    def copy(self) -> 'EmbeddingIndex':
+        index = copy.copy(self)
+        index.ids = list(self.ids)
+        index._rows = dict(self._rows)
+        index.matrix = None if self.matrix is None else self.matrix.copy()
+        index.scales = None if self.scales is None else self.scales.copy()
+        return index
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Positions of the top_k scores, best first, sorting only those k."""
+        top_k = min(top_k, len(scores))
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def search(self, query: np.ndarray, top_k: int = 1) -> List[tuple]:
+        """Return up to top_k (agent_id, cosine similarity) pairs, best first."""
+        if not self.ids or top_k <= 0:
+            return []
+
+        scores = self._scores(self._normalize(query))
+        return [(self.ids[row], float(scores[row])) for row in self._top_k(scores, top_k)]
+
+
+class IVFIndex(EmbeddingIndex):
+    """Approximate nearest-neighbour index using an inverted file over k-means clusters.
+
+    Rows are assigned to the closest of nlist centroids (sqrt(n) by default) and a
+    query only scores the rows in its nprobe closest clusters. Raising nprobe trades
+    latency for recall. Below min_size agents the index searches exactly.
+    """
+
+    def __init__(self, nprobe: int = 8, min_size: int = 1000, nlist: Optional[int] = None,
+                 iterations: int = 10, seed: int = 0, precision: str = "float32"):
+        super().__init__(precision)
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.nlist = nlist
+        self.iterations = iterations
+        self.seed = seed
+
+        self.centroids = None
+        self.assignments = None
+        self._trained_size = 0
+        # Rows per cluster, derived from assignments on the first search after a change
+        self._lists = None
+
+    def build(self, embeddings: Dict[str, np.ndarray]):
+        super().build(embeddings)
+        self._train()
+
+    def upsert(self, agent_id: str, vector: np.ndarray):
+        row = self._rows.get(agent_id)
+        super().upsert(agent_id, vector)
+        if self.centroids is None:
+            self._maybe_retrain()
+            return
+
+        cluster = np.int32(np.argmax(self.centroids @ self.vectors(self._rows[agent_id])))
+        self._lists = None
+        if row is None:
+            self.assignments = np.append(self.assignments, cluster)
+        else:
+            self.assignments[row] = cluster
+        self._maybe_retrain()
+
+    def remove(self, agent_id: str):
+        row = self._rows.get(agent_id)
+        if row is None:
+            return
+        if self.assignments is not None:
+            # Mirror the row swap EmbeddingIndex.remove performs
+            last = len(self.ids) - 1
+            self.assignments[row] = self.assignments[last]
+            self.assignments = self.assignments[:last]
+            self._lists = None
+        super().remove(agent_id)
+        self._maybe_retrain()
+
+    def copy(self) -> 'IVFIndex':
+        index = super().copy()
+        index.assignments = None if self.assignments is None else self.assignments.copy()
+        return index
+
+    def _maybe_retrain(self):
+        # Incremental inserts keep the old centroids until the catalog doubles or halves
+        size = len(self.ids)
+        if size < self.min_size:
+            self.centroids = None
+            self.assignments = None
+            self._lists = None
+        elif self.centroids is None or size > 2 * self._trained_size or size < self._trained_size // 2:
+            self._train()
+
+    def _train(self):
+        size = len(self.ids)
+        if size < self.min_size:
+            self.centroids = None
+            self.assignments = None
+            self._lists = None
+            return
+
+        nlist = min(size, self.nlist or max(1, int(np.sqrt(size))))
+        rng = np.random.default_rng(self.seed)
+        # Training works on a temporary float32 copy of quantized rows
+        vectors = self.vectors()
+        centroids = vectors[rng.choice(size, nlist, replace=False)].copy()
+
+        # Spherical k-means: vectors and centroids are unit length, so the
+        # closest centroid is the one with the largest dot product
+        for _ in range(self.iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            counts = np.bincount(assignments, minlength=nlist)
+            # Empty clusters keep their previous centroid
+            occupied = counts > 0
+            starts = (np.cumsum(counts) - counts)[occupied]
+            sums = np.add.reduceat(vectors[np.argsort(assignments, kind='stable')], starts, axis=0)
+            centroids[occupied] = self._normalize(sums)
+
+        self.centroids = centroids
+        self.assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        self._trained_size = size
+        self._lists = None
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        lists = self._lists
+        if lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            bounds = np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))
+            lists = np.split(order, bounds[:-1])
+            self._lists = lists
+        return lists
+
+    def search(self, query: np.ndarray, top_k: int = 1) -> List[tuple]:
+        if self.centroids is None or top_k <= 0:
+            return super().search(query, top_k)
+
+        query = self._normalize(query)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = self._top_k(self.centroids @ query, nprobe)
+        lists = self._inverted_lists()
+        candidates = np.concatenate([lists[cluster] for cluster in probes])
+        if len(candidates) < top_k:
+            return super().search(query, top_k)
+
+        scores = self._scores(query, candidates)
+        return [(self.ids[candidates[pos]], float(scores[pos])) for pos in self._top_k(scores, top_k)]
+
+    def measure_recall(self, queries: np.ndarray, top_k: int = 10) -> float:
+        """Fraction of the exact top_k results the approximate search returns for these queries."""
+        found = total = 0
+        for query in np.atleast_2d(queries):
+            exact = {agent_id for agent_id, _ in EmbeddingIndex.search(self, query, top_k)}
+            approximate = {agent_id for agent_id, _ in self.search(query, top_k)}
+            found += len(exact & approximate)
+            total += len(exact)
+        return found / total if total else 1.0
+
+
+class LexicalIndex:
+    """BM25 inverted index over agent names, descriptions, instructions and action group names.
+
+    Alongside ranked search it finds agents whose name or action group name appears
+    verbatim in a query, which is strong enough evidence to route without an embedding.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = {}
+        self._phrases = {}
+        self._longest_phrase = 0
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @staticmethod
+    def tokenize(text: Optional[str]) -> List[str]:
+        return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+    def build(self, agents: List[Dict[str, Any]]):
+        for agent in agents:
+            self.add(agent)
+
+    def add(self, agent: Dict[str, Any]):
+        agent_id = agent['agentId']
+        fields = [agent.get('name'), agent.get('description'), agent.get('instructions')]
+        fields.extend(agent.get('action_groups') or [])
+        terms = [term for field in fields for term in self.tokenize(field)]
+
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[agent_id] = count
+        self._lengths[agent_id] = len(terms)
+        self._total_length += len(terms)
+
+        for name in [agent.get('name')] + list(agent.get('action_groups') or []):
+            tokens = self.tokenize(name)
+            if tokens:
+                self._phrases.setdefault(" ".join(tokens), set()).add(agent_id)
+                self._longest_phrase = max(self._longest_phrase, len(tokens))
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self._lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 5) -> List[tuple]:
+        """Return up to top_k (agent_id, score) pairs, best first.
+
+        Scores are BM25 divided by the largest score the query terms could reach,
+        so they fall between 0 and 1 and are comparable across queries.
+        """
+        terms = set(self.tokenize(query))
+        if not terms or not self._lengths:
+            return []
+
+        average_length = self._total_length / len(self._lengths)
+        scores = {}
+        ceiling = 0.0
+        for term in terms:
+            idf = self._idf(term)
+            ceiling += idf * (self.k1 + 1)
+            for agent_id, tf in self._postings.get(term, {}).items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[agent_id] / average_length)
+                scores[agent_id] = scores.get(agent_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+        return [(agent_id, score / ceiling) for agent_id, score in ranked]
+
+    def exact_matches(self, query: str) -> set:
+        """Agents whose name or an action group name appears as a whole phrase in the query.
+
+        A one-word name only counts when no other agent uses that word anywhere, so a
+        common word such as "billing" or "support" is left to the ranked search.
+        """
+        tokens = self.tokenize(query)
+        matches = set()
+        # Look up every query n-gram up to the longest indexed phrase
+        for start in range(len(tokens)):
+            for end in range(start + 1, min(len(tokens), start + self._longest_phrase) + 1):
+                if end - start == 1 and len(self._postings.get(tokens[start], ())) > 1:
+                    continue
+                matches |= self._phrases.get(" ".join(tokens[start:end]), set())
+        return matches
+
+
 class BedrockAgentSelector:
-    def __init__(self, region: str = "us-west-2"):
-        self.bedrock_agent = boto3.client('bedrock-agent', region_name=region)
-        self.bedrock_runtime = boto3.client('bedrock-runtime', region_name=region)
-        self.bedrock_agent_runtime = boto3.client('bedrock-agent-runtime', region_name=region)
+    def __init__(self, region: str = DEFAULT_REGION, max_workers: int = 8, max_retries: int = 5,
+                 embedding_store_path: Optional[str] = None, query_cache_size: int = 1024,
+                 query_cache_ttl: float = 3600, query_cache_path: Optional[str] = None,
+                 query_cache_disk_size: Optional[int] = 100000, query_cache_disk_ttl: Optional[float] = 30 * 86400,
+                 index_mode: str = "exact", ann_nprobe: int = 8, ann_min_size: int = 1000,
+                 embedding_workers: int = 8, max_embedding_chars: int = MAX_EMBEDDING_CHARS,
+                 routing_mode: str = "semantic", lexical_threshold: float = 0.6, lexical_margin: float = 2.0,
+                 response_cache_ttl: Optional[float] = None, response_cache_size: int = 512,
+                 response_cache_agent_ttls: Optional[Dict[str, float]] = None,
+                 session_idle_timeout: float = 1800, session_drift_margin: Optional[float] = None,
+                 index_precision: str = "float32", regions: Optional[List[str]] = None,
+                 region_timeout: Optional[float] = DEFAULT_REGION_TIMEOUT, health_policy: Optional[HealthPolicy] = None,
+                 health_alpha: float = 0.2, metrics: Optional[MetricsSink] = None,
+                 snapshot_path: Optional[str] = None, offline: bool = False):
+        # Agents from every region form one catalog; each entry records its region and is
+        # invoked through that region's runtime. Embeddings are computed in the first region
+        self.regions = list(dict.fromkeys(regions or [region]))
+        self.region = self.regions[0]
+        self.bedrock_agents = {name: boto3.client('bedrock-agent', region_name=name) for name in self.regions}
+        self.bedrock_agent_runtimes = {name: boto3.client('bedrock-agent-runtime', region_name=name) for name in self.regions}
+        self.bedrock_agent = self.bedrock_agents[self.region]
+        self.bedrock_runtime = boto3.client('bedrock-runtime', region_name=self.region)
+        self.bedrock_agent_runtime = self.bedrock_agent_runtimes[self.region]
+        # Regions still loading after region_timeout seconds are left out of that load or
+        # refresh (a refresh keeps their previous agents); failures are kept in region_errors.
+        # None waits for every region
+        self.region_timeout = region_timeout
+        self.region_errors = {}
 
         self.agents_cache = None
+        self.agents_by_id = {}
         self.embedding_model = 'amazon.titan-embed-text-v2:0'
-        self.agent_embeddings = {}
-        
+
+        # "exact" scans every agent; "ivf" switches to an approximate index once the
+        # catalog reaches ann_min_size agents, probing ann_nprobe clusters per query
+        if index_mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index_mode {index_mode!r}; expected 'exact' or 'ivf'")
+        self.index_mode = index_mode
+        self.ann_nprobe = ann_nprobe
+        self.ann_min_size = ann_min_size
+        # "float16" or "int8" store the index compactly and score on the quantized rows
+        if index_precision not in INDEX_PRECISIONS:
+            raise ValueError(f"Unknown index_precision {index_precision!r}; expected one of {', '.join(INDEX_PRECISIONS)}")
+        self.index_precision = index_precision
+        self.agent_index = self._new_index()
+
+        # Agent profiles are embedded embedding_workers at a time; longer texts are
+        # split into max_embedding_chars chunks and pooled into one vector
+        self.embedding_workers = embedding_workers
+        self.max_embedding_chars = max_embedding_chars
+        self.embedding_errors = {}
+
+        # "hybrid" keeps a BM25 index next to the embeddings: a strong lexical hit routes
+        # without embedding the query, anything else fuses both rankings
+        if routing_mode not in ("semantic", "hybrid"):
+            raise ValueError(f"Unknown routing_mode {routing_mode!r}; expected 'semantic' or 'hybrid'")
+        self.routing_mode = routing_mode
+        self.lexical_threshold = lexical_threshold
+        self.lexical_margin = lexical_margin
+        self.lexical_index = None
+        self._stats_lock = threading.Lock()
+        self.routing_stats = {'lexical_routes': 0, 'hybrid_routes': 0, 'semantic_routes': 0, 'sticky_routes': 0}
+
+        # Opt-in: answers are only cached when a TTL is given
+        self.response_cache = None
+        if response_cache_ttl is not None:
+            self.response_cache = ResponseCache(response_cache_size, response_cache_ttl, response_cache_agent_ttls)
+
+        # Follow-ups stay with the pinned agent unless a strong lexical hit names another
+        # agent or, when session_drift_margin is set, another agent out-scores it
+        # semantically by more than that margin
+        self.sessions = SessionManager(session_idle_timeout)
+        self.session_drift_margin = session_drift_margin
+
+        # Timing spans for catalog loading, embedding, matching and invocation
+        self.metrics = metrics or MetricsSink()
+
+        # Every invocation feeds agent_health; health_policy uses it to break near-ties
+        self.agent_health = AgentHealth(health_alpha)
+        self.health_policy = health_policy or HealthPolicy()
+
+        # Agent embeddings persist across processes when a store directory is configured
+        embedding_store_path = embedding_store_path or os.environ.get('AGENT_EMBEDDING_STORE')
+        self.embedding_store = EmbeddingStore(embedding_store_path) if embedding_store_path else None
+
+        # Repeated queries skip the embedding round-trip; the disk tier may share the agent store,
+        # which is then left unbounded, and otherwise keeps query_cache_disk_size entries for
+        # up to query_cache_disk_ttl seconds
+        query_cache_path = query_cache_path or os.environ.get('AGENT_QUERY_CACHE_STORE')
+        if query_cache_path and embedding_store_path and os.path.abspath(os.path.expanduser(query_cache_path)) == self.embedding_store.path:
+            query_disk_store = self.embedding_store
+        elif query_cache_path:
+            query_disk_store = EmbeddingStore(query_cache_path, query_cache_disk_size, query_cache_disk_ttl)
+        else:
+            query_disk_store = None
+        self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_ttl, query_disk_store)
+
+        # With a registry snapshot the first load installs its catalog and stored embeddings,
+        # then merges newer live data in the background; offline=True never calls the
+        # Bedrock Agents control plane and serves the snapshot as it is
+        self.snapshot_path = snapshot_path or os.environ.get('AGENT_REGISTRY_SNAPSHOT')
+        self.offline = offline
+        if offline and not self.snapshot_path:
+            raise ValueError("offline=True needs a snapshot_path to load the catalog from")
+        self._snapshot_merge_thread = None
+
+        # Hydration settings: max_workers=1 describes agents one after another
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.hydration_errors = {}
+
+        # Queries read the catalog and index under _state_lock; refreshes build
+        # replacements off to the side and swap them in together
+        self._state_lock = threading.Lock()
+        self._refresh_lock = threading.RLock()
+        self._refresh_stop = None
+        self._refresh_thread = None
+
+    def _new_index(self) -> EmbeddingIndex:
+        if self.index_mode == "ivf":
+            return IVFIndex(nprobe=self.ann_nprobe, min_size=self.ann_min_size, precision=self.index_precision)
+        return EmbeddingIndex(self.index_precision)
+
+    def _call_with_retry(self, fn, **kwargs):
+        """Call a boto3 operation, backing off exponentially while it is throttled."""
+        return registry_snapshot.call_with_retry(fn, max_retries=self.max_retries, **kwargs)
+
+    def _hydrate_agent(self, agent_summary: Dict[str, Any]) -> Dict[str, Any]:
+        """Describe a single agent and resolve its aliases."""
+        agent_id = agent_summary.get('agentId')
+        region = agent_summary.get('region', self.region)
+        bedrock_agent = self.bedrock_agents[region]
+
+        with self.metrics.span("describe_agent", region=region):
+            agent_response = self._call_with_retry(bedrock_agent.get_agent, agentId=agent_id)
+        agent_info = agent_response['agent']
+
+        action_groups = None
+        if self.routing_mode == "hybrid":
+            # Action group names are only needed for lexical routing
+            def list_action_groups():
+                paginator = bedrock_agent.get_paginator('list_agent_action_groups')
+                return [
+                    group['actionGroupName']
+                    for page in paginator.paginate(agentId=agent_id, agentVersion='DRAFT')
+                    for group in page.get('actionGroupSummaries', [])
+                ]
+
+            # A throttled page restarts the listing rather than dropping the agent
+            with self.metrics.span("list_action_groups", region=region):
+                action_groups = self._call_with_retry(list_action_groups)
+
+        with self.metrics.span("list_aliases", region=region):
+            alias_response = self._call_with_retry(bedrock_agent.list_agent_aliases, agentId=agent_id)
+
+        return self._agent_entry(agent_info, agent_summary, region,
+                                 alias_response.get('agentAliasSummaries', []), action_groups)
+
+    def _agent_entry(self, agent_info: Dict[str, Any], agent_summary: Dict[str, Any], region: str,
+                     aliases: List[Dict[str, Any]], action_groups: Optional[List[str]]) -> Dict[str, Any]:
+        """Catalog entry from a get_agent description, its list_agents summary and its aliases."""
+        # Extract relevant information
+        agent_details = {
+            'name': agent_info.get('agentName'),
+            'agentId': agent_info.get('agentId'),
+            'region': region,
+            'instructions': agent_info.get('instruction'),
+            'description': agent_info.get('description'),
+            'status': agent_info.get('agentStatus'),
+            'foundation_model': agent_info.get('foundationModel'),
+            'created_at': agent_info.get('creationDateTime'),
+            'last_updated': agent_info.get('lastUpdatedDateTime'),
+            # updatedAt from list_agents, compared on refresh to spot changed agents
+            'summary_updated_at': agent_summary.get('updatedAt'),
+            'aliases': aliases,
+            'defaultAliasId' : ''
+        }
+        if action_groups is not None:
+            agent_details['action_groups'] = action_groups
+
+        agent_details['defaultAliasId'] = self._default_alias_id(agent_details['aliases'])
+        return agent_details
+
+    @staticmethod
+    def _default_alias_id(aliases: List[Dict[str, Any]]) -> Optional[str]:
+        if not aliases:
+            return None
+        latest_alias = max(aliases, key=lambda x: x['updatedAt'])
+        return latest_alias['agentAliasId']
+
+    def _try_refresh_aliases(self, agent: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Re-list an unchanged agent's aliases; return an updated entry if they changed."""
+        region = agent.get('region', self.region)
+        try:
+            with self.metrics.span("list_aliases", region=region):
+                alias_response = self._call_with_retry(self.bedrock_agents[region].list_agent_aliases,
+                                                       agentId=agent['agentId'])
+        except Exception as e:
+            logger.warning("Error listing aliases for agent %s: %s", agent['agentId'], e)
+            return None
+
+        aliases = alias_response.get('agentAliasSummaries', [])
+        if aliases == agent.get('aliases'):
+            return None
+        return {**agent, 'aliases': aliases, 'defaultAliasId': self._default_alias_id(aliases)}
+
+    def _try_hydrate_agent(self, agent_summary: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Hydrate an agent, recording the failure instead of raising so one agent can't sink the catalog."""
+        agent_id = agent_summary.get('agentId')
+        try:
+            return self._hydrate_agent(agent_summary)
+        except Exception as e:
+            logger.warning("Error loading agent %s: %s", agent_id, e)
+            self.hydration_errors[agent_id] = str(e)
+            return None
+
+    def _list_agent_summaries(self, region: Optional[str] = None) -> List[Dict[str, Any]]:
+        region = region or self.region
+        summaries = []
+        with self.metrics.span("list_agents", region=region):
+            paginator = self.bedrock_agents[region].get_paginator('list_agents')
+
+            # Paginate through all agents
+            for page in paginator.paginate():
+                summaries.extend({**summary, 'region': region} for summary in page.get('agentSummaries', []))
+        return summaries
+
+    def _map_regions(self, fn) -> Dict[str, Any]:
+        """Run fn(region) for every region concurrently and return the results by region.
+
+        Regions that raise or are still running after region_timeout are recorded in
+        region_errors and left out; only if every region fails is the first error raised.
+        A single region is always waited for, as there is no other region to serve.
+        """
+        self.region_errors = {}
+        if len(self.regions) == 1:
+            return {self.region: fn(self.region)}
+
+        executor = ThreadPoolExecutor(max_workers=len(self.regions), thread_name_prefix="agent-region")
+        futures = {executor.submit(fn, region): region for region in self.regions}
+        results = {}
+        first_error = None
+        try:
+            for future in as_completed(futures, timeout=self.region_timeout):
+                region = futures[future]
+                try:
+                    results[region] = future.result()
+                except Exception as e:
+                    logger.warning("Error loading agents from %s: %s", region, e)
+                    self.region_errors[region] = str(e)
+                    first_error = first_error or e
+        except FutureTimeoutError:
+            for future, region in futures.items():
+                if not future.done():
+                    logger.warning("Agents from %s still loading after %ss; skipping for now", region, self.region_timeout)
+                    self.region_errors[region] = f"timed out after {self.region_timeout}s"
+        finally:
+            # A slow region finishes in the background without holding up the others
+            executor.shutdown(wait=False)
+
+        if not results and first_error is not None:
+            raise first_error
+        return results
+
+    def _load_region(self, region: str) -> tuple:
+        """List and describe one region's agents: (agents, number listed)."""
+        summaries = self._list_agent_summaries(region)
+        return [agent for agent in self._hydrate_agents(summaries) if agent is not None], len(summaries)
+
+    def _hydrate_agents(self, summaries: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Hydrate summaries concurrently; failed agents come back as None in their slot."""
+        if self.max_workers <= 1 or len(summaries) <= 1:
+            return [self._try_hydrate_agent(summary) for summary in summaries]
+
+        # boto3 clients are thread safe; map() hands results back in list order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._try_hydrate_agent, summaries))
+
+    def _load_agents(self) -> List[Dict[str, Any]]:
+        self.hydration_errors = {}
+        results = self._map_regions(self._load_region)
+
+        agents = []
+        for region in self.regions:
+            if region in results:
+                agents.extend(results[region][0])
+        if self.hydration_errors:
+            listed = sum(count for _, count in results.values())
+            logger.warning("Skipped %d of %d agents that failed to load", len(self.hydration_errors), listed)
+        return self._unique_agents(agents)
+
+    @staticmethod
+    def _unique_agents(agents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Agent IDs are random and in practice unique across regions; keep the first
+        # region's agent if two ever collide
+        seen = {}
+        for agent in agents:
+            if agent['agentId'] in seen:
+                logger.warning("Agent %s found in %s and %s; keeping %s", agent['agentId'],
+                               seen[agent['agentId']]['region'], agent.get('region'), seen[agent['agentId']]['region'])
+                continue
+            seen[agent['agentId']] = agent
+        return list(seen.values())
+
+    def _agent_from_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        action_groups = None
+        if self.routing_mode == "hybrid":
+            action_groups = [group['actionGroupName'] for group in record['action_groups']]
+        return self._agent_entry(record['agent'], record['summary'], record['region'], record['aliases'], action_groups)
+
+    def load_snapshot(self, path: Optional[str] = None) -> int:
+        """Install the catalog and embeddings of a registry snapshot; returns the number of agents.
+
+        Only agents of the selector's regions are loaded. Stored embeddings are reused when
+        they were computed with the same model from the same profile text; other agents are
+        embedded now. Raises registry_snapshot.SnapshotError if the file cannot be used.
+        """
+        snapshot = registry_snapshot.load_snapshot(path or self.snapshot_path)
+        agents = self._unique_agents([
+            self._agent_from_record(record) for record in snapshot['agents']
+            if record['region'] in self.regions
+        ])
+
+        stored = registry_snapshot.decode_embeddings(snapshot, self.embedding_model)
+        embeddings, missing = {}, []
+        for agent in agents:
+            profile, vector = stored.get(agent['agentId'], (None, None))
+            if profile is not None and profile == registry_snapshot.profile_hash(self._agent_profile_text(agent)):
+                embeddings[agent['agentId']] = vector
+            else:
+                missing.append(agent)
+        self.embedding_errors = {}
+        if missing:
+            embeddings.update(self._embed_agents(missing))
+
+        index = self._new_index()
+        index.build(embeddings)
+        with self._refresh_lock:
+            self._install_catalog(agents, index)
+        logger.info("Loaded %d agents from snapshot, %d embedded afresh", len(agents), len(missing))
+        return len(agents)
+
+    def _cold_start(self) -> bool:
+        """Load the configured snapshot; online, newer live data is merged in on a background thread."""
+        try:
+            self.load_snapshot()
+        except registry_snapshot.SnapshotError as e:
+            if self.offline:
+                raise
+            logger.warning("Loading agents live: %s", e)
+            return False
+
+        if not self.offline:
+            # An incremental refresh only describes agents changed since the snapshot
+            self._snapshot_merge_thread = threading.Thread(
+                target=self._merge_live, name="agent-snapshot-merge", daemon=True
+            )
+            self._snapshot_merge_thread.start()
+        return True
+
+    def _merge_live(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Could not merge live agents into the snapshot catalog: %s", e)
+
+    def export_snapshot(self, path: Optional[str] = None, include_embeddings: bool = True) -> Dict[str, str]:
+        """Write a registry snapshot of every region; returns the agents or regions that failed.
+
+        An existing snapshot at path is updated in place: agents whose updatedAt has not
+        changed keep their records. Embeddings are taken from the live index (at its
+        storage precision), which is built first if needed.
+        """
+        if self.offline:
+            raise RuntimeError("Cannot export a snapshot in offline mode")
+        path = path or self.snapshot_path
+        if not path:
+            raise ValueError("export_snapshot needs a path, or a snapshot_path on the selector")
+        try:
+            previous = registry_snapshot.load_snapshot(path) if os.path.exists(os.path.expanduser(path)) else None
+        except registry_snapshot.SnapshotError as e:
+            logger.warning("Ignoring existing snapshot: %s", e)
+            previous = None
+        records, errors = registry_snapshot.collect_registry(self.bedrock_agents, previous, self.max_workers)
+
+        embeddings = None
+        if include_embeddings:
+            self.warm_up()
+            with self._state_lock:
+                index, agents_by_id = self.agent_index, self.agents_by_id
+            vectors = index.vectors() if len(index) else []
+            embeddings = registry_snapshot.encode_embeddings(self.embedding_model, {
+                agent_id: (self._agent_profile_text(agents_by_id[agent_id]), vectors[row])
+                for row, agent_id in enumerate(index.ids) if agent_id in agents_by_id
+            })
+        registry_snapshot.save_snapshot(path, registry_snapshot.new_snapshot(records, self.regions, embeddings))
+        return errors
+
     def get_all_agents(self, refresh_cache: bool = False) -> List[Dict[str, Any]]:
         if self.agents_cache is not None and not refresh_cache:
             return self.agents_cache
-            
-        agents = []
-        paginator = self.bedrock_agent.get_paginator('list_agents')
-        
-        # Paginate through all agents
-        for page in paginator.paginate():
-            for agent_summary in page.get('agentSummaries', []):
-                agent_id = agent_summary.get('agentId')
-                agentName = agent_summary.get('agentName')
-
-                agent_response = self.bedrock_agent.get_agent(agentId=agent_id)
-                agent_info = agent_response['agent']
-
-                # Extract relevant information
-                agent_details = {
-                    'name': agent_info.get('agentName'),
-                    'agentId': agent_info.get('agentId'),
-                    'instructions': agent_info.get('instruction'),
-                    'status': agent_info.get('agentStatus'),
-                    'foundation_model': agent_info.get('foundationModel'),
-                    'created_at': agent_info.get('creationDateTime'),
-                    'last_updated': agent_info.get('lastUpdatedDateTime'),
-                    'aliases': [],
-                    'defaultAliasId' : ''
-                }
-                alias_response = self.bedrock_agent.list_agent_aliases(agentId=agent_id)
-                agent_details['aliases'] = alias_response.get('agentAliasSummaries', [])
-                if agent_details['aliases']:
-                    latest_alias = max(agent_details['aliases'], key=lambda x: x['updatedAt'])
-                    agent_details['defaultAliasId'] = latest_alias['agentAliasId']
-                else:
-                    agent_details['defaultAliasId'] = None
-                    
-                agents.append(agent_details)
-        
-        self.agents_cache = agents
+
+        if self.agents_cache is None and self.snapshot_path:
+            with self._refresh_lock:
+                if self.agents_cache is None and self._cold_start():
+                    return self.agents_cache
+
+        if self.agents_cache is not None:
+            self.refresh()
+            return self.agents_cache
+
+        # Embeddings are built lazily for a new catalog
+        agents = self._load_agents()
+        self._install_catalog(agents, self._new_index())
         return agents
+
+    def _install_catalog(self, agents: List[Dict[str, Any]], index: EmbeddingIndex):
+        # Built in every mode: sticky sessions use it to spot follow-ups that change topic
+        lexical_index = LexicalIndex()
+        lexical_index.build(agents)
+
+        with self._state_lock:
+            self.agents_cache = agents
+            self.agents_by_id = {agent['agentId']: agent for agent in agents}
+            self.agent_index = index
+            self.lexical_index = lexical_index
+
+    def refresh(self, full: bool = False):
+        """Bring the catalog and embedding index up to date without interrupting queries in flight.
+
+        By default only agents whose list_agents updatedAt changed, or that were added or
+        deleted, are described and re-embedded. full=True reloads everything. Offline
+        selectors keep serving their snapshot.
+        """
+        if self.offline:
+            if self.agents_cache is None:
+                self.get_all_agents()
+            return
+
+        with self._refresh_lock:
+            if full or self.agents_cache is None:
+                agents = self._load_agents()
+                index = self._build_index(agents)
+                changed = len(agents)
+            else:
+                agents, index, changed = self._incremental_refresh()
+
+            self._install_catalog(agents, index)
+        logger.info("Refreshed catalog: %d agents, %d added, changed or deleted", len(agents), changed)
+
+    def _incremental_refresh(self) -> tuple:
+        with self._state_lock:
+            cached, old_index = self.agents_by_id, self.agent_index
+
+        self.hydration_errors = {}
+        # Updating an alias leaves the agent's updatedAt alone, so agents with cached
+        # answers have their aliases re-listed to keep the response cache honest
+        answered = self.response_cache.agent_ids() if self.response_cache is not None else set()
+
+        def refresh_region(region):
+            summaries = self._list_agent_summaries(region)
+            stale = [
+                summary for summary in summaries
+                if summary.get('agentId') not in cached
+                or summary.get('updatedAt') != cached[summary['agentId']].get('summary_updated_at')
+            ]
+            stale_ids = {summary['agentId'] for summary in stale}
+            unchanged = [
+                cached[summary['agentId']] for summary in summaries
+                if summary['agentId'] in answered and summary['agentId'] not in stale_ids
+            ]
+            return summaries, stale, self._hydrate_agents(stale), [self._try_refresh_aliases(agent) for agent in unchanged]
+
+        results = self._map_regions(refresh_region)
+
+        summaries, stale, refreshed, realiased = [], [], {}, {}
+        for region in self.regions:
+            if region not in results:
+                continue
+            region_summaries, region_stale, hydrated, aliased = results[region]
+            summaries.extend(region_summaries)
+            stale.extend(region_stale)
+            for summary, agent in zip(region_stale, hydrated):
+                if agent is not None:
+                    refreshed[summary['agentId']] = agent
+            for agent in aliased:
+                if agent is not None:
+                    realiased[agent['agentId']] = agent
+
+        # Agents of a region that failed or timed out stay as they were
+        listed_ids = {summary.get('agentId') for summary in summaries}
+        listed_ids.update(
+            agent_id for agent_id, agent in cached.items()
+            if agent.get('region', self.region) not in results
+        )
+        deleted = [agent_id for agent_id in cached if agent_id not in listed_ids]
+
+        # An agent that failed to re-describe keeps its previous entry until the next refresh
+        agents = []
+        for summary in summaries:
+            agent = refreshed.get(summary['agentId']) or realiased.get(summary['agentId']) or cached.get(summary['agentId'])
+            if agent is not None:
+                agents.append(agent)
+        agents.extend(
+            agent for agent in cached.values()
+            if agent.get('region', self.region) not in results
+        )
+        agents = self._unique_agents(agents)
+
+        # An empty index is still built lazily on the next query
+        # Agents that previously failed to embed get another attempt
+        for agent_id in list(self.embedding_errors):
+            if agent_id not in listed_ids:
+                del self.embedding_errors[agent_id]
+            elif agent_id not in refreshed and agent_id in cached:
+                refreshed[agent_id] = cached[agent_id]
+
+        index = old_index
+        if old_index and (refreshed or deleted):
+            index = old_index.copy()
+            for agent_id in deleted:
+                index.remove(agent_id)
+            to_embed = [
+                agent for agent_id, agent in refreshed.items()
+                if agent_id not in cached or agent_id not in index
+                or self._agent_profile_text(cached[agent_id]) != self._agent_profile_text(agent)
+            ]
+            for agent_id, embedding in self._embed_agents(to_embed).items():
+                index.upsert(agent_id, embedding)
+
+        return agents, index, len(stale) + len(deleted) + len(realiased)
+
+    def warm_up(self):
+        """Load the catalog and embed every agent so the first query only embeds itself."""
+        self.get_all_agents()
+        if not self.agent_index:
+            self._create_agent_embeddings()
+
+    def start_background_refresh(self, interval_seconds: float):
+        """Refresh the catalog every interval_seconds on a daemon thread."""
+        if self.offline or (self._refresh_thread is not None and self._refresh_thread.is_alive()):
+            return
+
+        stop = threading.Event()
+
+        def refresh_loop():
+            while not stop.wait(interval_seconds):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep serving the last good catalog until the next attempt
+                    logger.warning("Background catalog refresh failed: %s", e)
+
+        self._refresh_stop = stop
+        self._refresh_thread = threading.Thread(target=refresh_loop, name="agent-catalog-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        if self._refresh_stop is not None:
+            self._refresh_stop.set()
+        self._refresh_thread = None
+        self._refresh_stop = None
     
     def _get_embedding(self, text: str) -> np.ndarray:
+        """Embed text with Titan, retrying throttled calls; raises EmbeddingError on failure."""
         try:
-            response = self.bedrock_runtime.invoke_model(
-                modelId=self.embedding_model,
-                body=json.dumps({"inputText": text})
-            )
-            embedding = json.loads(response.get("body").read())["embedding"]
-            return np.array(embedding)
+            with self.metrics.span("embed"):
+                response = self._call_with_retry(
+                    self.bedrock_runtime.invoke_model,
+                    modelId=self.embedding_model,
+                    body=json.dumps({"inputText": text})
+                )
+                embedding = json.loads(response.get("body").read())["embedding"]
+            return np.array(embedding, dtype=np.float32)
         except Exception as e:
-            print(f"Error getting embedding: {e}")
-            # Return zero vector as fallback
-            return np.zeros(1536)
-    
-    def _cosine_similarity(self, v1: np.ndarray, v2: np.ndarray) -> float:
-        """Calculate cosine similarity between two vectors."""
-        norm_v1 = np.linalg.norm(v1)
-        norm_v2 = np.linalg.norm(v2)
-        
-        if norm_v1 == 0 or norm_v2 == 0:
-            return 0
-            
-        return np.dot(v1, v2) / (norm_v1 * norm_v2)
+            raise EmbeddingError(f"Error getting embedding: {e}") from e
     
+    def _get_query_embedding(self, query: str) -> np.ndarray:
+        embedding = self.query_cache.get(self.embedding_model, query)
+        if embedding is not None:
+            return embedding
+
+        embedding = self._get_embedding(query)
+        self.query_cache.put(self.embedding_model, query, embedding)
+        return embedding
+
+    def _get_agent_embedding(self, text: str) -> np.ndarray:
+        """Embed agent text, reusing the persistent store when the same text was embedded before."""
+        if self.embedding_store is None:
+            return self._get_embedding(text)
+
+        embedding = self.embedding_store.get(self.embedding_model, text)
+        if embedding is not None:
+            return embedding
+
+        embedding = self._get_embedding(text)
+        self.embedding_store.put(self.embedding_model, text, embedding, flush=False)
+        return embedding
+
+    @staticmethod
+    def _agent_profile_text(agent: Dict[str, Any]) -> str:
+        """Text that represents an agent for routing; agents without instructions fall back to name and description."""
+        if agent.get('instructions'):
+            return agent['instructions']
+        return "\n".join(part for part in (agent.get('name'), agent.get('description')) if part)
+
+    def _chunk_text(self, text: str) -> List[str]:
+        """Split text into chunks under max_embedding_chars, preferring line and word boundaries."""
+        limit = self.max_embedding_chars
+        chunks = []
+        while len(text) > limit:
+            cut = text.rfind('\n', 0, limit)
+            if cut < limit // 2:
+                cut = text.rfind(' ', 0, limit)
+            if cut < limit // 2:
+                cut = limit
+            chunks.append(text[:cut])
+            text = text[cut:].lstrip()
+        if text:
+            chunks.append(text)
+        return chunks
+
+    def _embed_text(self, text: str) -> np.ndarray:
+        chunks = self._chunk_text(text)
+        if len(chunks) == 1:
+            return self._get_agent_embedding(chunks[0])
+
+        # Pool unit-length chunk vectors, weighted by chunk length
+        vectors = EmbeddingIndex._normalize(np.stack([self._get_agent_embedding(chunk) for chunk in chunks]))
+        weights = np.array([len(chunk) for chunk in chunks], dtype=np.float32)
+        return (weights[:, np.newaxis] * vectors).sum(axis=0) / weights.sum()
+
+    def _try_embed_agent(self, agent: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Embed an agent's profile, flagging it in embedding_errors instead of scoring it as a zero vector."""
+        agent_id = agent['agentId']
+        text = self._agent_profile_text(agent)
+        if not text:
+            self.embedding_errors[agent_id] = "Agent has no instructions, name or description to embed"
+            return None
+        try:
+            embedding = self._embed_text(text)
+        except EmbeddingError as e:
+            logger.warning("Error embedding agent %s: %s", agent_id, e)
+            self.embedding_errors[agent_id] = str(e)
+            return None
+        self.embedding_errors.pop(agent_id, None)
+        return embedding
+
+    def _embed_agents(self, agents: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """Embed many agents with bounded concurrency; agents that fail are left out and flagged."""
+        if self.embedding_workers <= 1 or len(agents) <= 1:
+            vectors = [self._try_embed_agent(agent) for agent in agents]
+        else:
+            with ThreadPoolExecutor(max_workers=self.embedding_workers) as executor:
+                vectors = list(executor.map(self._try_embed_agent, agents))
+
+        if self.embedding_store is not None:
+            self.embedding_store.flush()
+
+        embeddings = {agent['agentId']: vector for agent, vector in zip(agents, vectors) if vector is not None}
+        if len(embeddings) < len(agents):
+            logger.warning("%d of %d agents could not be embedded and will not be routed to",
+                           len(agents) - len(embeddings), len(agents))
+        return embeddings
+
+    def _build_index(self, agents: List[Dict[str, Any]]) -> EmbeddingIndex:
+        self.embedding_errors = {}
+        index = self._new_index()
+        index.build(self._embed_agents(agents))
+        return index
+
     def _create_agent_embeddings(self):
         """Create embeddings for all agents based on their descriptions and instructions."""
+        index = self._build_index(self.get_all_agents())
+        with self._state_lock:
+            self.agent_index = index
+
+    def _semantic_match(self, query: str, top_k: int = 1) -> List[Dict]:
+        # Ensure we have agent embeddings; concurrent first queries build them once
+        if not self.agent_index:
+            with self._refresh_lock:
+                if not self.agent_index:
+                    self._create_agent_embeddings()
+
+        with self._state_lock:
+            index, agents_by_id = self.agent_index, self.agents_by_id
+        with self.metrics.span("query_embedding"):
+            query_embedding = self._get_query_embedding(query)
+
+        logger.debug("Matching query against %d agents", len(index))
+
+        with self.metrics.span("match"):
+            matches = index.search(query_embedding, top_k)
+        return [{"agent": agents_by_id[agent_id], "score": score} for agent_id, score in matches]
+
+    def _lexical_route(self, query: str) -> Optional[Dict]:
+        """Pick an agent from the BM25 index alone when the evidence is unambiguous."""
         agents = self.get_all_agents()
-        
-        for agent in agents:
-            # Create a rich representation of the agent
-            self.agent_embeddings[agent['agentId']] = self._get_embedding(agent['instructions'])
-    
-    def _semantic_match(self, query: str) -> Dict:
-        # Ensure we have agent embeddings
-        if not self.agent_embeddings:
-            self._create_agent_embeddings()
-            
-        agents = self.get_all_agents()
-        query_embedding = self._get_embedding(query)
-        
-        print(f""" found {len(agents)} agents""")
+        with self._state_lock:
+            lexical_index, agents_by_id = self.lexical_index, self.agents_by_id
+        if lexical_index is None or not agents:
+            return None
+
+        with self.metrics.span("lexical_match"):
+            exact = lexical_index.exact_matches(query)
+            hits = lexical_index.search(query, top_k=2) if len(exact) != 1 else []
+        if len(exact) == 1:
+            agent_id = exact.pop()
+            return {"agent": agents_by_id[agent_id], "score": 1.0, "route": "lexical"}
+        if not hits or hits[0][1] < self.lexical_threshold:
+            return None
+        if len(hits) > 1 and hits[0][1] < self.lexical_margin * hits[1][1]:
+            return None
+        agent_id, score = hits[0]
+        return {"agent": agents_by_id[agent_id], "score": score, "route": "lexical"}
+
+    def _hybrid_match(self, query: str, top_k: int) -> List[Dict]:
+        """Fuse the semantic and BM25 rankings with reciprocal rank fusion.
+
+        The fused score is the ranking key and is returned as "score", scaled so an agent
+        ranked first by both is 1.0; the inputs are kept as "semantic_score" and "lexical_score".
+        Adjacent fused scores sit less than 0.02 apart whatever the similarity gap, so the
+        tie window and confidence checks use "confidence", the larger of the two inputs.
+        """
+        depth = max(top_k, 20)
+        semantic = self._semantic_match(query, depth)
+        with self._state_lock:
+            lexical_index, agents_by_id = self.lexical_index, self.agents_by_id
+        lexical = lexical_index.search(query, depth) if lexical_index is not None else []
+
+        fused = {}
+        for rank, match in enumerate(semantic):
+            entry = fused.setdefault(match["agent"]["agentId"], {"agent": match["agent"], "score": 0.0, "semantic_score": 0.0, "lexical_score": 0.0})
+            entry["semantic_score"] = match["score"]
+            entry["score"] += RRF_K / (RRF_K + rank) / 2
+        for rank, (agent_id, score) in enumerate(lexical):
+            entry = fused.setdefault(agent_id, {"agent": agents_by_id[agent_id], "score": 0.0, "semantic_score": 0.0, "lexical_score": 0.0})
+            entry["lexical_score"] = score
+            entry["score"] += RRF_K / (RRF_K + rank) / 2
+
+        ranked = sorted(fused.values(), key=lambda entry: -entry["score"])[:top_k]
+        for entry in ranked:
+            entry["route"] = "hybrid"
+            entry["confidence"] = max(entry["semantic_score"], entry["lexical_score"])
+        return ranked
+
+    def _count_route(self, route: str):
+        with self._stats_lock:
+            self.routing_stats[f"{route}_routes"] += 1
+
+    def rank_agents(self, query: str, top_k: int = 5) -> List[Dict]:
+        """Return the top_k agents for a query as [{"agent": ..., "score": ...}], best first.
+
+        In hybrid mode each entry also carries the "route" that produced it; a strong
+        lexical hit is returned on its own without embedding the query.
+
+        Candidates within the health policy's tie margin of the best are reordered by
+        their recent error rate and latency; they carry the "health_penalty" applied.
+        """
+        candidates = max(top_k, self.health_policy.candidates)
+        with self.metrics.span("rank"):
+            if self.routing_mode == "semantic":
+                ranked = self._semantic_match(query, candidates)
+                route = "semantic"
+            else:
+                lexical = self._lexical_route(query)
+                if lexical is not None:
+                    ranked, route = [lexical], "lexical"
+                else:
+                    ranked, route = self._hybrid_match(query, candidates), "hybrid"
+
+        if ranked:
+            self._count_route(route)
+        return self.health_policy.rerank(ranked, self.agent_health)[:top_k]
+
+    def get_agent_health(self) -> List[Dict[str, Any]]:
+        """Rolling latency, time to first chunk and error rate for every agent alias invoked."""
+        return self.agent_health.stats()
+
+    def _has_drifted(self, session: Dict[str, Any], query: str) -> tuple:
+        """Return (drifted, agent) for a follow-up to a pinned conversation.
+
+        When a lexical hit names another agent that agent is returned, so the caller
+        pins it directly; semantic drift returns no agent and the query is re-routed.
+        """
+        lexical = self._lexical_route(query)
+        if lexical is not None:
+            if lexical["agent"]["agentId"] == session['agent_id']:
+                return False, None
+            return True, lexical["agent"]
+        if self.session_drift_margin is None:
+            return False, None
+
+        ranked = self._semantic_match(query, top_k=len(self.agent_index) or 1)
+        pinned_score = next((match["score"] for match in ranked if match["agent"]["agentId"] == session['agent_id']), None)
+        if pinned_score is None:
+            return True, None
+        return ranked[0]["score"] - pinned_score > self.session_drift_margin, None
+
+    def route_conversation(self, conversation_id: str, query: str) -> tuple:
+        """Return (agent, session) for a message in a caller conversation.
+
+        Follow-ups reuse the pinned agent and Bedrock session; the first message, an
+        expired pin or a drifting query selects an agent and starts a new session.
+        """
+        session = self.sessions.get(conversation_id)
+        if session is not None:
+            with self._state_lock:
+                agent = self.agents_by_id.get(session['agent_id'])
+            if agent is not None:
+                drifted, named = self._has_drifted(session, query)
+                if not drifted:
+                    self._count_route("sticky")
+                    return agent, session
+                if named is not None:
+                    # The follow-up names another agent; pin it rather than re-ranking
+                    self._count_route("lexical")
+                    return named, self.sessions.pin(conversation_id, named)
+
+        agent = self.select_agent(query)
+        if agent is None:
+            self.sessions.end(conversation_id)
+            return None, None
+        return agent, self.sessions.pin(conversation_id, agent)
+
+    def converse(self, conversation_id: str, query: str) -> Dict:
+        """Route a conversation message with sticky sessions and invoke the agent."""
+        agent, session = self.route_conversation(conversation_id, query)
+        if agent is None:
+            return {"response": "", "agent_id": None, "session_id": None}
+        response = self.invoke_agent(agent, query, session=session)
+        response["session_id"] = session['session_id']
+        return response
+
+    def get_routing_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.routing_stats)
 
-        similarities = []
-        for agent in agents:
-            agent_id = agent["agentId"]
-            if agent_id in self.agent_embeddings:
-                similarity = self._cosine_similarity(query_embedding, self.agent_embeddings[agent_id])
-                similarities.append({
-                    "agent": agent,
-                    "score": similarity
-                })
-        
-        # Find the agent with the highest similarity
-        best_match = max(similarities, key=lambda x: x["score"]) if similarities else {"agent": None, "score": 0}
-        print(f""" {best_match['agent']['name']} will help with the request""")
-        return best_match
-    
     def select_agent(self, query: str, threshold: float = 0.6) -> Dict:
-        match_result = self._semantic_match(query)
-        
-        best_agent = match_result["agent"]
-        confidence = match_result["score"]
+        ranked = self.rank_agents(query, top_k=1)
+        if not ranked:
+            logger.info("No agents available to handle the request")
+            return None
 
-        print(best_agent["agentId"])
-        print(best_agent["defaultAliasId"])
+        best_agent = ranked[0]["agent"]
+        confidence = _confidence(ranked[0])
+
+        if confidence < threshold:
+            logger.info("Low routing confidence %.3f (threshold %s); consider fan_out()", confidence, threshold)
+        logger.info("%s will help with the request (agent %s, alias %s)",
+                    best_agent['name'], best_agent["agentId"], best_agent["defaultAliasId"])
 
         return best_agent
     
-    def invoke_agent(self, best_agent, query):
-        agentResponse = self.bedrock_agent_runtime.invoke_agent(
-            agentId=best_agent["agentId"],
-            agentAliasId=best_agent["defaultAliasId"],  # Changed from aliasId to agentAliasId
-            sessionId=str(uuid4()),  # Generate a unique session ID
-            inputText=query,  # The actual prompt/question for the agent
-        )
+    def invoke_agent_stream(self, best_agent, query, include_trace: bool = False, session: Optional[Dict] = None):
+        """Invoke an agent and yield decoded response chunks as they arrive.
+
+        With include_trace=True, trace events are also yielded, as dicts, in stream order.
+        Closing the generator early closes the underlying completion stream. When the
+        response cache holds an answer it is yielded as a single chunk without invoking
+        the agent; fully streamed answers are added to the cache.
 
+        Pass a session from route_conversation to continue its Bedrock session on the
+        pinned alias. Session turns depend on earlier turns, so they bypass the cache.
+        """
+        cached = self._cached_response(best_agent, query, session)
+        if cached is not None:
+            yield cached
+            return
+
+        yield from self._stream_and_cache(best_agent, query, include_trace, session)
+
+    def _stream_and_cache(self, best_agent, query, include_trace: bool = False, session: Optional[Dict] = None):
+        chunks = []
+        for item in self._stream_completion(best_agent, query, include_trace, session):
+            if isinstance(item, str):
+                chunks.append(item)
+            yield item
+
+        if self.response_cache is not None and session is None:
+            self.response_cache.put(best_agent, best_agent["defaultAliasId"], query, "".join(chunks))
+
+    def _cached_response(self, best_agent, query, session: Optional[Dict] = None) -> Optional[str]:
+        if self.response_cache is None or session is not None:
+            return None
+        return self.response_cache.get(best_agent, best_agent["defaultAliasId"], query)
+
+    def _stream_completion(self, best_agent, query, include_trace: bool = False, session: Optional[Dict] = None):
+        alias_id = session['alias_id'] if session else best_agent["defaultAliasId"]
+        started = time.perf_counter()
+        first_chunk = latency = None
+        failed = False
+        try:
+            # Agents are invoked in the region they were listed from
+            with self.metrics.span("invoke_start", region=best_agent.get('region', self.region)):
+                agentResponse = self.bedrock_agent_runtimes[best_agent.get('region', self.region)].invoke_agent(
+                    agentId=best_agent["agentId"],
+                    agentAliasId=alias_id,  # Changed from aliasId to agentAliasId
+                    sessionId=session['session_id'] if session else str(uuid4()),  # Generate a unique session ID
+                    inputText=query,  # The actual prompt/question for the agent
+                    enableTrace=include_trace,
+                )
+
+            completion = agentResponse['completion']
+            # A multi-byte character can be split across two chunks
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            try:
+                for event in completion:
+                    if 'chunk' in event:
+                        chunk = event['chunk']
+                        if 'bytes' in chunk:
+                            text = decoder.decode(chunk['bytes'])
+                            if text:
+                                if first_chunk is None:
+                                    first_chunk = time.perf_counter() - started
+                                yield text
+                    elif include_trace and 'trace' in event:
+                        yield event['trace']
+
+                text = decoder.decode(b'', final=True)
+                if text:
+                    yield text
+                latency = time.perf_counter() - started
+            finally:
+                if hasattr(completion, 'close'):
+                    completion.close()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # A stream closed early by the caller records its time to first chunk only
+            self.agent_health.record(best_agent["agentId"], alias_id, latency, first_chunk, failed)
+            if self.metrics.enabled:
+                if first_chunk is not None:
+                    self.metrics.observe("first_chunk", first_chunk, {})
+                if latency is not None:
+                    self.metrics.observe("stream_complete", latency, {})
+                elif failed:
+                    self.metrics.observe("stream_complete", time.perf_counter() - started, {'outcome': 'error'})
+
+    def invoke_agent(self, best_agent, query, session: Optional[Dict] = None):
         # Process the completion stream
-        full_response = ""
-        for event in agentResponse['completion']:
-            if 'chunk' in event:
-                chunk = event['chunk']
-                if 'bytes' in chunk:
-                    full_response += chunk['bytes'].decode()
+        full_response = "".join(self.invoke_agent_stream(best_agent, query, session=session))
 
         # You might want to return both the response and the confidence score
         return {
             "response": full_response,
             "agent_id": best_agent["agentId"]
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def is_ambiguous(ranked: List[Dict], threshold: float = 0.6, margin: float = 0.05) -> bool:
+        """True when the best confidence is below threshold or the top two are within margin.
+
+        Confidence is the similarity score, or in hybrid mode the larger of an entry's
+        semantic and lexical scores.
+        """
+        if not ranked:
+            return False
+        if _confidence(ranked[0]) < threshold:
+            return True
+        return len(ranked) > 1 and _confidence(ranked[0]) - _confidence(ranked[1]) < margin
+
+    def fan_out(self, query: str, top_k: int = 3, threshold: float = 0.6, margin: float = 0.05,
+                wait_for_all: bool = False, accept=None, timeout: Optional[float] = None) -> List[Dict]:
+        """Invoke the top-k agents concurrently when routing is ambiguous.
+
+        A confident ranking (see is_ambiguous) invokes only the best agent. Otherwise the
+        top_k candidates are invoked in parallel and, by default, the first answer that
+        passes accept (non-empty text unless given) is returned and the other completion
+        streams are closed. With wait_for_all=True every answer is returned. If no answer
+        is accepted, or when waiting for all, the answers are ordered by routing score.
+
+        Each answer is {"response", "agent_id", "agent", "score", "latency", "error"}.
+        timeout bounds the wait in seconds; answers still streaming by then are dropped.
+        """
+        ranked = self.rank_agents(query, top_k=max(top_k, 1))
+        if not ranked:
+            return []
+        candidates = ranked if self.is_ambiguous(ranked, threshold, margin) else ranked[:1]
+        if accept is None:
+            accept = lambda text: bool(text.strip())
+
+        cancelled = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="agent-fan-out")
+        futures = [pool.submit(self._fan_out_invoke, candidate, query, cancelled) for candidate in candidates]
+        answers = []
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                answer = future.result()
+                if answer is None:
+                    continue
+                answers.append(answer)
+                if not wait_for_all and answer["error"] is None and accept(answer["response"]):
+                    return [answer]
+        except FutureTimeoutError:
+            logger.info("Fan-out timed out after %ss with %d of %d answers", timeout, len(answers), len(candidates))
+        finally:
+            # Streams still running notice this at their next chunk and close themselves
+            cancelled.set()
+            pool.shutdown(wait=False)
+
+        answers.sort(key=lambda answer: answer["score"], reverse=True)
+        return answers
+
+    def _fan_out_invoke(self, candidate: Dict, query: str, cancelled: threading.Event) -> Optional[Dict]:
+        agent = candidate["agent"]
+        started = time.perf_counter()
+        answer = {"response": None, "agent_id": agent["agentId"], "agent": agent,
+                  "score": candidate["score"], "latency": None, "error": None}
+        if cancelled.is_set():
+            return None
+
+        chunks = []
+        stream = self.invoke_agent_stream(agent, query)
+        try:
+            for chunk in stream:
+                if cancelled.is_set():
+                    return None
+                chunks.append(chunk)
+        except Exception as e:
+            # Any failure, including connection errors and timeouts, stays with its candidate
+            logger.warning("Error invoking agent %s: %s", agent['agentId'], e)
+            answer["error"] = str(e)
+        finally:
+            stream.close()
+
+        answer["latency"] = time.perf_counter() - started
+        if answer["error"] is None:
+            answer["response"] = "".join(chunks)
+        return answer
+
+    # asyncio API: boto3 is blocking, so every AWS call runs on a worker thread and
+    # the event loop stays free to serve other requests
+
+    async def arank_agents(self, query: str, top_k: int = 5) -> List[Dict]:
+        return await asyncio.to_thread(self.rank_agents, query, top_k)
+
+    async def aselect_agent(self, query: str, threshold: float = 0.6) -> Dict:
+        return await asyncio.to_thread(self.select_agent, query, threshold)
+
+    async def afan_out(self, query: str, top_k: int = 3, threshold: float = 0.6, margin: float = 0.05,
+                       wait_for_all: bool = False, accept=None, timeout: Optional[float] = None) -> List[Dict]:
+        return await asyncio.to_thread(self.fan_out, query, top_k, threshold, margin, wait_for_all, accept, timeout)
+
+    async def aroute_conversation(self, conversation_id: str, query: str) -> tuple:
+        return await asyncio.to_thread(self.route_conversation, conversation_id, query)
+
+    async def ainvoke_agent_stream(self, best_agent, query, include_trace: bool = False, session: Optional[Dict] = None):
+        """Async counterpart of invoke_agent_stream; the event stream is read on a worker thread."""
+        cached = self._cached_response(best_agent, query, session)
+        if cached is not None:
+            yield cached
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        cancelled = threading.Event()
+
+        def publish(item, error=None):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                # The event loop has already shut down
+                cancelled.set()
+
+        def pump():
+            try:
+                stream = self._stream_and_cache(best_agent, query, include_trace, session)
+                try:
+                    for item in stream:
+                        if cancelled.is_set():
+                            break
+                        publish(item)
+                finally:
+                    stream.close()
+                publish(finished)
+            except Exception as e:
+                publish(finished, e)
+
+        loop.run_in_executor(None, pump)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is finished:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            # Stop the worker if the consumer goes away before the stream ends
+            cancelled.set()
+
+    async def ainvoke_agent(self, best_agent, query, session: Optional[Dict] = None):
+        chunks = [chunk async for chunk in self.ainvoke_agent_stream(best_agent, query, session=session)]
+        return {
+            "response": "".join(chunks),
+            "agent_id": best_agent["agentId"]
+        }
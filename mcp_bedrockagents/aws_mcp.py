@@ -1,49 +1,143 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 from dotenv import load_dotenv
+import asyncio
 import httpx
 import json
+import logging
 import os
+import threading
 from bs4 import BeautifulSoup
 import boto3
-from agentselector import BedrockAgentSelector
+from agentselector import DEFAULT_REGION_TIMEOUT, BedrockAgentSelector, InMemoryMetrics, MetricsSink, regions_from_env
 
 load_dotenv()
 
+# stdout carries the MCP stdio stream; diagnostics from the selector's warm-up and
+# background refresh threads go to stderr
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 mcp = FastMCP("aws-mcp")
 
-@mcp.tool()  
-async def agent_registry(query: str):
+# Seconds between background catalog refreshes; 0 disables refreshing
+AGENT_REFRESH_INTERVAL = float(os.environ.get("AGENT_REFRESH_INTERVAL", "300"))
+
+# Seconds to serve repeated questions from the response cache; unset disables caching
+AGENT_RESPONSE_CACHE_TTL = os.environ.get("AGENT_RESPONSE_CACHE_TTL")
+
+# Storage precision of the agent embedding index: float32, float16 or int8
+AGENT_INDEX_PRECISION = os.environ.get("AGENT_INDEX_PRECISION", "float32")
+
+# Regions to route across: BEDROCK_AGENT_REGIONS (comma-separated), else AWS_REGION
+AGENT_REGIONS = regions_from_env()
+
+# Seconds to wait for each region while loading the catalog; 0 waits for every region
+AGENT_REGION_TIMEOUT = float(os.environ.get("AGENT_REGION_TIMEOUT", DEFAULT_REGION_TIMEOUT))
+
+# Registry snapshot to cold-start from is read from AGENT_REGISTRY_SNAPSHOT; with
+# AGENT_OFFLINE=1 the catalog is served from it alone, without listing or describing agents
+AGENT_OFFLINE = os.environ.get("AGENT_OFFLINE", "0") == "1"
+
+# "1" records timing spans, readable from the metrics:// resources
+AGENT_METRICS = os.environ.get("AGENT_METRICS", "0") == "1"
+metrics = InMemoryMetrics() if AGENT_METRICS else MetricsSink()
+
+# One warm selector per server process, shared by every tool call
+_agent_selector = None
+_agent_selector_lock = threading.Lock()
+
+
+def get_agent_selector() -> BedrockAgentSelector:
+    """Return the process-wide selector, loading its catalog and embeddings on first use."""
+    global _agent_selector
+    with _agent_selector_lock:
+        if _agent_selector is None:
+            agent_selector = BedrockAgentSelector(
+                regions=AGENT_REGIONS,
+                region_timeout=AGENT_REGION_TIMEOUT or None,
+                response_cache_ttl=float(AGENT_RESPONSE_CACHE_TTL) if AGENT_RESPONSE_CACHE_TTL else None,
+                index_precision=AGENT_INDEX_PRECISION,
+                metrics=metrics,
+                offline=AGENT_OFFLINE,
+            )
+            agent_selector.warm_up()
+            if AGENT_REFRESH_INTERVAL > 0:
+                agent_selector.start_background_refresh(AGENT_REFRESH_INTERVAL)
+            _agent_selector = agent_selector
+    return _agent_selector
+
+
+async def aget_agent_selector() -> BedrockAgentSelector:
+    # The first call may wait on the warm-up, so keep it off the event loop
+    if _agent_selector is not None:
+        return _agent_selector
+    return await asyncio.to_thread(get_agent_selector)
+
+
+async def route_query(agent_selector: BedrockAgentSelector, query: str, conversation_id: str):
+    """Pick the agent for a query, reusing the conversation's pinned agent and session if any."""
+    if conversation_id:
+        return await agent_selector.aroute_conversation(conversation_id, query)
+    return await agent_selector.aselect_agent(query), None
+
+
+async def stream_agent_response(agent_selector: BedrockAgentSelector, best_agent, query: str, ctx: Context,
+                                session=None) -> str:
+    """Invoke the agent, reporting progress to the client as each chunk arrives."""
+    # Routing finds no agent when the catalog is empty
+    if best_agent is None:
+        return "Couldn't find a suitable agent for your query."
+    await ctx.report_progress(0, message=f"Routing to {best_agent['name']}")
+
+    chunks = []
+    received = 0
+    async for chunk in agent_selector.ainvoke_agent_stream(best_agent, query, session=session):
+        chunks.append(chunk)
+        received += len(chunk)
+        await ctx.report_progress(len(chunks), message=f"Received {received} characters")
+    return "".join(chunks)
+
+
+@mcp.tool()
+async def agent_registry(query: str, ctx: Context, conversation_id: str = ""):
     """Query the Agent registry for information related to Agentic memory and Agents roles in Software Engineering
-    
+
     Args:
         query: The query string to search for
+        conversation_id: Optional id shared by follow-up queries so they stay with the same agent session
     """
-    agent_selector = BedrockAgentSelector()
-    best_agent = agent_selector.select_agent(query)
-    response_text = agent_selector.invoke_agent(best_agent, query)
+    agent_selector = await aget_agent_selector()
+    best_agent, session = await route_query(agent_selector, query, conversation_id)
 
-    return response_text['response']
+    return await stream_agent_response(agent_selector, best_agent, query, ctx, session)
 
 
-if __name__ == "__main__":
-    mcp.run(transport="stdio")
-
 @mcp.tool()
-async def kb_registry(query: str):
+async def kb_registry(query: str, ctx: Context, conversation_id: str = ""):
     """Query the Knowledgebase registry for information related to Agentic memory and Agents roles in Software Engineering
-    
+
     Args:
         query: The query string to search for
+        conversation_id: Optional id shared by follow-up queries so they stay with the same agent session
     """
-    agent_selector = BedrockAgentSelector()
-    best_agent = agent_selector.select_agent(query)
-    response_text = agent_selector.invoke_agent(best_agent, query)
+    agent_selector = await aget_agent_selector()
+    best_agent, session = await route_query(agent_selector, query, conversation_id)
 
-    return response_text['response']
+    return await stream_agent_response(agent_selector, best_agent, query, ctx, session)
 
 
+@mcp.resource("metrics://agent-selector/prometheus", mime_type="text/plain")
+def selector_metrics_prometheus() -> str:
+    """Timing spans of agent selection and invocation in the Prometheus text format"""
+    return metrics.to_prometheus() if metrics.enabled else ""
+
+
+@mcp.resource("metrics://agent-selector/json", mime_type="application/json")
+def selector_metrics_json() -> str:
+    """Timing spans of agent selection and invocation as JSON"""
+    return metrics.to_json() if metrics.enabled else json.dumps({"spans": []})
 
 
 if __name__ == "__main__":
+    # Warm the catalog while the client completes the MCP handshake
+    threading.Thread(target=get_agent_selector, name="agent-catalog-warmup", daemon=True).start()
     mcp.run(transport="stdio")
-
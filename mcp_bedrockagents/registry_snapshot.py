@@ -0,0 +1,339 @@
+"""Versioned snapshots of a Bedrock agent registry.
+
+A snapshot holds everything the registry dashboard, the agent assistant and the MCP
+server read from the Bedrock Agents control plane: per agent its list_agents summary,
+get_agent description, aliases, action groups with their schemas, knowledge bases with
+their data sources, and collaborators, plus (optionally) the agent embeddings used for
+routing. It is one gzip-compressed JSON file, so it loads in milliseconds and lets each
+tool start without describing every agent, or run read-only without AWS access.
+
+    python registry_snapshot.py export registry.json.gz --regions us-west-2,us-east-1
+    python registry_snapshot.py info registry.json.gz
+
+Exporting over an existing snapshot only describes agents whose updatedAt changed.
+
+This file is the authoritative copy. mcp_bedrockagents/registry_snapshot.py is an
+identical copy; agent_registry/registry_snapshot.py is the same without --embeddings.
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import boto3
+import numpy as np
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+SNAPSHOT_FORMAT = "bedrock-agent-registry"
+# Bump when the layout changes; readers refuse snapshots newer than they understand
+SNAPSHOT_VERSION = 1
+
+# Version whose action groups, knowledge bases and collaborators are captured
+AGENT_VERSION = "DRAFT"
+
+# Error codes Bedrock returns when a caller is being rate limited
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+}
+MAX_RETRIES = 5
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is missing, unreadable or written by a newer version."""
+
+
+def _encode(value: Any) -> Any:
+    # boto3 returns datetimes; tag them so they come back as datetimes
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in a snapshot")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def dumps(snapshot: Dict[str, Any]) -> bytes:
+    return gzip.compress(json.dumps(snapshot, default=_encode, separators=(",", ":")).encode("utf-8"))
+
+
+def loads(data: bytes) -> Dict[str, Any]:
+    """Parse and validate a snapshot; raises SnapshotError."""
+    try:
+        snapshot = json.loads(gzip.decompress(data), object_hook=_decode)
+    except (OSError, EOFError, ValueError) as e:
+        raise SnapshotError(f"Not a registry snapshot: {e}") from e
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not a registry snapshot")
+
+    version = snapshot.get("version")
+    if not isinstance(version, int) or version > SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot version {version} is not supported (this reader handles up to {SNAPSHOT_VERSION})")
+    return snapshot
+
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    path = os.path.expanduser(path)
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except OSError as e:
+        raise SnapshotError(f"Cannot read snapshot {path}: {e}") from e
+
+
+def save_snapshot(path: str, snapshot: Dict[str, Any]):
+    """Write a snapshot atomically, so readers never see a partial file."""
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(snapshot))
+    os.replace(tmp_path, path)
+
+
+def new_snapshot(records: List[Dict[str, Any]], regions: List[str],
+                 embeddings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now(timezone.utc),
+        "regions": list(regions),
+        "agents": records,
+        "embeddings": embeddings,
+    }
+
+
+def records_by_id(snapshot: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    if not snapshot:
+        return {}
+    return {record["agent"]["agentId"]: record for record in snapshot.get("agents", [])}
+
+
+def is_current(record: Optional[Dict[str, Any]], summary: Optional[Dict[str, Any]]) -> bool:
+    """Whether a snapshot record still describes the agent in a live list_agents summary."""
+    return (
+        record is not None and summary is not None
+        and record["summary"].get("updatedAt") == summary.get("updatedAt")
+    )
+
+
+def profile_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode_embeddings(model_id: str, vectors: Dict[str, Tuple[str, np.ndarray]]) -> Dict[str, Any]:
+    """Embeddings section from {agent id: (profile text, vector)}.
+
+    Each vector is stored with a hash of the text it was computed from, so a reader
+    can tell when an agent's profile has changed since the export.
+    """
+    return {
+        "model": model_id,
+        "vectors": {
+            agent_id: {
+                "profile": profile_hash(text),
+                "vector": base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii"),
+            }
+            for agent_id, (text, vector) in vectors.items()
+        },
+    }
+
+
+def decode_embeddings(snapshot: Dict[str, Any], model_id: str) -> Dict[str, Tuple[str, np.ndarray]]:
+    """{agent id: (profile hash, vector)} for embeddings computed with model_id."""
+    embeddings = snapshot.get("embeddings")
+    if not embeddings or embeddings.get("model") != model_id:
+        return {}
+    return {
+        agent_id: (entry["profile"], np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32))
+        for agent_id, entry in embeddings.get("vectors", {}).items()
+    }
+
+
+def call_with_retry(fn, max_retries: int = MAX_RETRIES, **kwargs):
+    """Call a boto3 operation, backing off exponentially while it is throttled."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(**kwargs)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code not in THROTTLING_ERROR_CODES or attempt == max_retries:
+                raise
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            time.sleep(random.uniform(0, min(10.0, 0.2 * (2 ** attempt))))
+
+
+def _paginate(bedrock_agent, operation: str, key: str, **kwargs) -> List[Dict[str, Any]]:
+    def collect():
+        items = []
+        for page in bedrock_agent.get_paginator(operation).paginate(**kwargs):
+            items.extend(page.get(key, []))
+        return items
+
+    # A throttled page restarts the listing
+    return call_with_retry(collect)
+
+
+def _list_collaborators(bedrock_agent, agent_id: str) -> List[Dict[str, Any]]:
+    # Not paginated by boto3
+    collaborators = []
+    kwargs = {"agentId": agent_id, "agentVersion": AGENT_VERSION}
+    while True:
+        response = call_with_retry(bedrock_agent.list_agent_collaborators, **kwargs)
+        collaborators.extend(response.get("agentCollaboratorSummaries", []))
+        if not response.get("nextToken"):
+            return collaborators
+        kwargs["nextToken"] = response["nextToken"]
+
+
+def describe_agent(bedrock_agent, summary: Dict[str, Any], region: str) -> Dict[str, Any]:
+    """Snapshot record of one agent, read from the control plane; throttled calls are retried."""
+    agent_id = summary["agentId"]
+    agent = call_with_retry(bedrock_agent.get_agent, agentId=agent_id)["agent"]
+
+    action_groups = _paginate(bedrock_agent, "list_agent_action_groups", "actionGroupSummaries",
+                              agentId=agent_id, agentVersion=AGENT_VERSION)
+    action_group_details = {
+        group["actionGroupId"]: call_with_retry(
+            bedrock_agent.get_agent_action_group,
+            agentId=agent_id, agentVersion=AGENT_VERSION, actionGroupId=group["actionGroupId"]
+        )["agentActionGroup"]
+        for group in action_groups
+    }
+
+    knowledge_bases = _paginate(bedrock_agent, "list_agent_knowledge_bases", "agentKnowledgeBaseSummaries",
+                                agentId=agent_id, agentVersion=AGENT_VERSION)
+    knowledge_base_details, data_sources = {}, {}
+    for kb in knowledge_bases:
+        kb_id = kb["knowledgeBaseId"]
+        knowledge_base_details[kb_id] = call_with_retry(bedrock_agent.get_knowledge_base, knowledgeBaseId=kb_id)["knowledgeBase"]
+        data_sources[kb_id] = _paginate(bedrock_agent, "list_data_sources", "dataSourceSummaries", knowledgeBaseId=kb_id)
+
+    return {
+        "region": region,
+        "summary": summary,
+        "agent": agent,
+        "aliases": _paginate(bedrock_agent, "list_agent_aliases", "agentAliasSummaries", agentId=agent_id),
+        "action_groups": action_groups,
+        "action_group_details": action_group_details,
+        "knowledge_bases": knowledge_bases,
+        "knowledge_base_details": knowledge_base_details,
+        "data_sources": data_sources,
+        "collaborators": _list_collaborators(bedrock_agent, agent_id),
+    }
+
+
+def collect_registry(clients: Dict[str, Any], previous: Optional[Dict[str, Any]] = None,
+                     max_workers: int = 8) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Snapshot records for every agent reachable through clients ({region: bedrock-agent client}).
+
+    Agents whose updatedAt matches their record in previous are reused as they are; the
+    rest are described concurrently. An agent that fails to describe keeps its previous
+    record when there is one. Returns (records, {agent id or region: error}).
+    """
+    cached = records_by_id(previous)
+    records, errors, stale = [], {}, []
+    for region, bedrock_agent in clients.items():
+        try:
+            summaries = _paginate(bedrock_agent, "list_agents", "agentSummaries")
+        except Exception as e:
+            # A region that cannot be listed keeps its previous records
+            errors[region] = str(e)
+            records.extend(record for record in cached.values() if record["region"] == region)
+            continue
+        for summary in summaries:
+            record = cached.get(summary["agentId"])
+            if is_current(record, summary) and record["region"] == region:
+                records.append(record)
+            else:
+                stale.append((region, summary))
+
+    def describe(item):
+        region, summary = item
+        try:
+            return describe_agent(clients[region], summary, region)
+        except Exception as e:
+            errors[summary["agentId"]] = str(e)
+            return cached.get(summary["agentId"])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        records.extend(record for record in executor.map(describe, stale) if record is not None)
+    return records, errors
+
+
+def _describe(snapshot: Dict[str, Any], path: str) -> str:
+    records = snapshot.get("agents", [])
+    embeddings = snapshot.get("embeddings") or {}
+    lines = [
+        f"{path}: version {snapshot['version']}, created {snapshot.get('created_at')}",
+        f"  regions: {', '.join(snapshot.get('regions', []))}",
+        f"  agents: {len(records)}, action groups: {sum(len(r['action_groups']) for r in records)}, "
+        f"knowledge bases: {sum(len(r['knowledge_bases']) for r in records)}",
+        f"  embeddings: {len(embeddings.get('vectors', {}))} ({embeddings.get('model', 'none')})",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write (or bring up to date) a snapshot from the live registry")
+    export.add_argument("path")
+    export.add_argument("--regions", default=os.environ.get("BEDROCK_AGENT_REGIONS") or os.environ.get("AWS_REGION", "us-west-2"),
+                        help="Comma-separated regions (default: BEDROCK_AGENT_REGIONS, else AWS_REGION)")
+    export.add_argument("--workers", type=int, default=8)
+    export.add_argument("--embeddings", action="store_true",
+                        help="Also store agent embeddings (needs agentselector.py next to this file)")
+
+    info = commands.add_parser("info", help="Summarize a snapshot")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        print(_describe(load_snapshot(args.path), args.path))
+        return
+
+    regions = [region.strip() for region in args.regions.split(",") if region.strip()]
+    if args.embeddings:
+        from agentselector import BedrockAgentSelector
+        errors = BedrockAgentSelector(regions=regions, max_workers=args.workers).export_snapshot(args.path)
+    else:
+        try:
+            previous = load_snapshot(args.path) if os.path.exists(os.path.expanduser(args.path)) else None
+        except SnapshotError as e:
+            print(f"Ignoring existing snapshot: {e}")
+            previous = None
+        config = Config(retries={"mode": "adaptive", "max_attempts": 10})
+        clients = {region: boto3.client("bedrock-agent", region_name=region, config=config) for region in regions}
+        records, errors = collect_registry(clients, previous, args.workers)
+        # Stored embeddings carry a profile hash, so those of changed agents are ignored on load
+        embeddings = previous.get("embeddings") if previous else None
+        if embeddings:
+            agent_ids = {record["agent"]["agentId"] for record in records}
+            embeddings = {**embeddings, "vectors": {
+                agent_id: entry for agent_id, entry in embeddings["vectors"].items() if agent_id in agent_ids
+            }}
+        save_snapshot(args.path, new_snapshot(records, regions, embeddings))
+
+    for name, error in errors.items():
+        print(f"  {name}: {error}", file=sys.stderr)
+    print(_describe(load_snapshot(args.path), args.path))
+
+
+if __name__ == "__main__":
+    main()